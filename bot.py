@@ -1,20 +1,61 @@
 import os
+import io
+import html
+import signal
 import re
 import json
 import logging
 import asyncio
 from urllib.parse import quote, urljoin, urlparse
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from flask import Flask, render_template, jsonify, request, Response
-from flask_cors import CORS
-from threading import Thread
+from datetime import datetime, timedelta, timezone
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, Message
+from telegram.error import BadRequest
+from telegram.ext import Application, AIORateLimiter, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from quart import Quart, render_template, request, Response
+from quart_cors import cors
+from hypercorn.asyncio import serve
+from hypercorn.config import Config as HypercornConfig
 import aiohttp
-import requests
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from pymongo.errors import ConnectionFailure
+from pymongo import MongoClient, IndexModel, ReplaceOne, UpdateOne, ASCENDING, DESCENDING
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
 import hashlib
+import functools
+import heapq
+import itertools
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson parses/encodes several times faster; fall back to stdlib json without it
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
+# Aho-Corasick keyword scan for categorize_basic; regex alternations without it
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# XXH3 fingerprints large playlists several times faster than BLAKE2b; BLAKE2b without it
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# libuv-backed event loop for the bot, web server and HTTP clients; stock asyncio without it
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # Configure logging
 logging.basicConfig(
@@ -26,29 +67,162 @@ logger = logging.getLogger(__name__)
 # Bot Configuration
 BOT_TOKEN = os.environ.get('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
-ADMIN_IDS = [int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip()]
+ADMIN_IDS = frozenset(int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip())
 PORT = int(os.environ.get('PORT', 5000))
 WEBAPP_URL = os.environ.get('WEBAPP_URL', 'https://your-app.herokuapp.com')
 MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+DB_NAME = os.environ.get('DB_NAME', 'tv_bot')
+# Set when DB_NAME holds nothing but this bot's data: admin clear then drops
+# the whole database (stats included) instead of individual collections
+DEDICATED_DB = os.environ.get('DEDICATED_DB', '').lower() in ('1', 'true', 'yes')
+# Webhook mode: Telegram pushes updates to WEBAPP_URL/telegram instead of being long-polled
+USE_WEBHOOK = os.environ.get('USE_WEBHOOK', '').lower() in ('1', 'true', 'yes')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
 
 # Pagination settings - 2 columns layout
 CATEGORIES_PER_PAGE = 10  # 5 rows x 2 columns
 CHANNELS_PER_PAGE = 10    # 5 rows x 2 columns
 
+# Startup connection attempts before falling back to in-memory storage
+MONGO_CONNECT_ATTEMPTS = int(os.environ.get('MONGO_CONNECT_ATTEMPTS', 3))
+
+# Worker threads for blocking DB calls and parsers; the change-stream watcher holds one
+IO_WORKERS = int(os.environ.get('IO_WORKERS', 16))
+
+# Seconds to reuse stats query results (play/user counters change outside imports)
+READ_CACHE_TTL = int(os.environ.get('READ_CACHE_TTL', 30))
+
+# LRU for single-channel lookups hit by the player/proxy on every segment
+CHANNEL_CACHE_SIZE = 2048
+CHANNEL_CACHE_TTL = 300
+
+# Documents per MongoDB cursor round-trip for full-collection reads
+CURSOR_BATCH_SIZE = 500
+
+# Index specs; applied at startup and again after admin clear drops collections
+# (category, name, _id) covers category pages and the category listing on its own
+CHANNEL_INDEXES = [
+    [('category', ASCENDING), ('name', ASCENDING), ('_id', ASCENDING)],
+    [('needs_category', ASCENDING)],
+]
+
+# Old indexes: id_1 is superseded by _id, the category ones are prefixes of
+# the covering compound index, and nothing queries by name alone
+OBSOLETE_CHANNEL_INDEXES = ['id_1', 'category_1', 'name_1', 'category_1_name_1', 'category_1__id_1']
+
+# Source records expire server-side after this long; the duplicate window is far shorter
+SOURCE_TTL = 3600
+
+# Legacy documents re-keyed per bulk write
+MIGRATION_BATCH = 1000
+
+def migrate_legacy_ids():
+    """Re-key documents from the old ObjectId schema to _id = channel id, in bulk batches"""
+    cursor = channels_col.find({'_id': {'$type': 'objectId'}}).batch_size(MIGRATION_BATCH)
+    moved = skipped = failed = 0
+    try:
+        for batch in iter(lambda: list(itertools.islice(cursor, MIGRATION_BATCH)), []):
+            old_ids, replacements = [], []
+            for legacy in batch:
+                if not legacy.get('id'):
+                    skipped += 1
+                    continue
+                old_ids.append(legacy['_id'])
+                legacy['_id'] = legacy['id']
+                replacements.append(ReplaceOne({'_id': legacy['id']}, legacy, upsert=True))
+            if not replacements:
+                continue
+            # Replace first, then delete only the originals whose copy was written, so an
+            # unordered failure can never drop a channel
+            try:
+                channels_col.bulk_write(replacements, ordered=False)
+                errors = set()
+            except BulkWriteError as e:
+                errors = {err['index'] for err in e.details.get('writeErrors', [])}
+                failed += len(errors)
+            done = [old_id for i, old_id in enumerate(old_ids) if i not in errors]
+            if done:
+                channels_col.delete_many({'_id': {'$in': done}})
+                moved += len(done)
+    except PyMongoError as e:
+        # A migration problem must not take MongoDB persistence down with it
+        logger.warning(f"⚠️ Legacy channel migration stopped: {e}")
+    
+    if moved:
+        logger.info(f"🔑 Re-keyed {moved} legacy channels")
+    if skipped or failed:
+        logger.warning(f"⚠️ Left {skipped} legacy channels without an id and {failed} failed writes on their old keys")
+
+def normalize_categories():
+    """Store legacy None/'' categories as 'Other', so page queries match the menu counts"""
+    try:
+        # {'category': None} also matches documents without the field
+        result = channels_col.update_many({'category': {'$in': [None, '']}}, {'$set': {'category': 'Other'}})
+        if result.modified_count:
+            logger.info(f"🗂 Moved {result.modified_count} uncategorized channels to Other")
+    except PyMongoError as e:
+        logger.warning(f"⚠️ Category cleanup skipped: {e}")
+
+def ensure_indexes():
+    """Create channel/source indexes (no-op when they already exist)"""
+    channels_col.create_indexes([IndexModel(keys) for keys in CHANNEL_INDEXES])
+    sources_col.create_indexes([
+        IndexModel([('hash', ASCENDING)], unique=True),
+        IndexModel([('processed_at', ASCENDING)], expireAfterSeconds=SOURCE_TTL)
+    ])
+
+def connect_mongo(attempts=MONGO_CONNECT_ATTEMPTS):
+    """Connect with exponential backoff, so a database that is still starting isn't missed"""
+    client = MongoClient(
+        MONGO_URI,
+        serverSelectionTimeoutMS=5000,
+        connectTimeoutMS=5000,
+        socketTimeoutMS=15000,
+        # Only the I/O worker threads talk to MongoDB; a few spare for startup work
+        maxPoolSize=IO_WORKERS + 4,
+        minPoolSize=4,
+        # Compress channel scans on the wire; zstd when installed, zlib otherwise
+        compressors='zstd,zlib',
+        appname='jiotv-bot'
+    )
+    for attempt in range(1, attempts + 1):
+        try:
+            client.server_info()
+            return client
+        except ConnectionFailure as e:
+            if attempt == attempts:
+                client.close()
+                raise
+            delay = 2 ** (attempt - 1)
+            logger.warning(f"⚠️ MongoDB not reachable (attempt {attempt}/{attempts}): {e}; retrying in {delay}s")
+            time.sleep(delay)
+
 # MongoDB Setup
 try:
-    mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    mongo_client.server_info()
-    db = mongo_client['tv_bot']
+    mongo_client = connect_mongo()
+    db = mongo_client[DB_NAME]
     channels_col = db['channels']
+    # Bulk imports need the primary's ack (for new/updated counts) but not the
+    # replica-set w:majority default; admin deletes keep the default
+    channels_ingest_col = channels_col.with_options(write_concern=WriteConcern(w=1))
     categories_col = db['categories']
-    stats_col = db['stats']
+    # Counters are already batched; don't wait for acks on their periodic $inc flushes
+    stats_col = db.get_collection('stats', write_concern=WriteConcern(w=0))
     sources_col = db['sources']
+    # Completion details are informational (claims go through sources_col); skip the ack wait
+    source_marks_col = sources_col.with_options(write_concern=WriteConcern(w=0))
+    categorizations_col = db['categorizations']
     
-    channels_col.create_index([('id', ASCENDING)], unique=True)
-    channels_col.create_index([('category', ASCENDING)])
-    channels_col.create_index([('name', ASCENDING)])
-    sources_col.create_index([('hash', ASCENDING)], unique=True)
+    # Channels are keyed by _id = channel id; re-key documents from the old
+    # ObjectId schema once and drop the secondary unique index it needed
+    existing_indexes = channels_col.index_information()
+    for name in OBSOLETE_CHANNEL_INDEXES:
+        if name in existing_indexes:
+            channels_col.drop_index(name)
+    migrate_legacy_ids()
+    
+    normalize_categories()
+    ensure_indexes()
     
     logger.info("✅ MongoDB connected successfully")
     MONGO_ENABLED = True
@@ -56,9 +230,12 @@ except (ConnectionFailure, Exception) as e:
     logger.warning(f"⚠️ MongoDB not available: {e}. Using in-memory storage.")
     MONGO_ENABLED = False
     channels_col = None
+    channels_ingest_col = None
     categories_col = None
     stats_col = None
     sources_col = None
+    source_marks_col = None
+    categorizations_col = None
 
 # Gemini AI Setup
 gemini_model = None
@@ -74,6 +251,7 @@ if GEMINI_API_KEY:
 # In-memory cache
 channels_cache = {}
 categories_cache = {}
+ai_category_cache = {}  # normalized channel name -> Gemini category
 bot_stats = {
     'total_users': set(),
     'total_plays': 0,
@@ -85,207 +263,535 @@ bot_settings = {
     'maintenance_mode': False
 }
 
-# Flask App
-app = Flask(__name__, template_folder='templates', static_folder='static')
-CORS(app)
+# Default headers for proxied upstream requests
+PROXY_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Referer': 'https://www.jiocinema.com/',
+    'Origin': 'https://www.jiocinema.com'
+}
+
+# Web App (Quart keeps the Flask API but serves routes on an asyncio loop)
+app = Quart(__name__, template_folder='templates', static_folder='static')
+app = cors(app, allow_origin='*')
+
+# Async HTTP session for streamed segments; bound to the web server's loop
+SEGMENT_SESSION = None
+SEGMENT_READ_BUFSIZE = 256 * 1024
+
+@app.before_serving
+async def open_segment_session():
+    global SEGMENT_SESSION
+    SEGMENT_SESSION = aiohttp.ClientSession(
+        # Players pull a segment every few seconds; keep upstream sockets warm between them
+        connector=aiohttp.TCPConnector(limit=256, ttl_dns_cache=300, keepalive_timeout=30),
+        headers=PROXY_HEADERS,
+        # Larger read buffer -> fewer, bigger chunks forwarded per segment
+        read_bufsize=SEGMENT_READ_BUFSIZE
+    )
+
+@app.after_serving
+async def close_segment_session():
+    if SEGMENT_SESSION:
+        await SEGMENT_SESSION.close()
 
 # ============= DATABASE FUNCTIONS =============
 
-def get_all_channels():
-    """Get all channels from DB or cache"""
+_read_cache = {}
+# Bumped by invalidate_read_cache so a read that raced a write isn't stored
+_read_cache_gen = 0
+
+def cached_read(func=None, *, ttl=None):
+    """Reuse a zero-arg read result until invalidate_read_cache(), or for ttl seconds"""
+    if func is None:
+        return functools.partial(cached_read, ttl=ttl)
+    
+    # One refill per function at a time; concurrent misses wait and reuse it
+    lock = threading.Lock()
+    
+    def fresh():
+        hit = _read_cache.get(func.__name__)
+        if hit and (ttl is None or time.monotonic() - hit[0] < ttl):
+            return hit
+    
+    @functools.wraps(func)
+    def wrapper():
+        hit = fresh()
+        if hit:
+            return hit[1]
+        with lock:
+            hit = fresh()
+            if hit:
+                return hit[1]
+            gen = _read_cache_gen
+            value = func()
+            if gen == _read_cache_gen:
+                _read_cache[func.__name__] = (time.monotonic(), value)
+            return value
+    return wrapper
+
+_channel_cache = OrderedDict()
+_channel_cache_lock = threading.Lock()
+
+def invalidate_read_cache():
+    """Drop cached reads after channel data changes"""
+    global _read_cache_gen
+    _read_cache_gen += 1
+    _read_cache.clear()
+    _category_menus.clear()
+    with _channel_cache_lock:
+        _channel_cache.clear()
+
+# The backend is fixed at startup, so pick run_db's dispatch once instead of per call
+if MONGO_ENABLED:
+    async def run_db(func, *args, **kwargs):
+        """Run a blocking DB helper in a worker thread so the event loop keeps serving"""
+        return await asyncio.to_thread(func, *args, **kwargs)
+else:
+    async def run_db(func, *args, **kwargs):
+        """Memory mode: helpers only touch in-process dicts, so call them inline"""
+        return func(*args, **kwargs)
+
+# Fields the web app's channel list needs; everything else stays on the server
+SUMMARY_FIELDS = {'_id': 0, 'id': 1, 'name': 1, 'logo': 1, 'link': 1, 'category': 1, 'stream_type': 1}
+
+def list_channels_summary():
+    """Iterator over all channels, projected server-side to SUMMARY_FIELDS"""
     if MONGO_ENABLED:
-        channels = list(channels_col.find({}, {'_id': 0}))
-        return {ch['id']: ch for ch in channels}
-    return channels_cache
+        return channels_col.find({}, SUMMARY_FIELDS).batch_size(CURSOR_BATCH_SIZE)
+    return iter(list(channels_cache.values()))
+
+def get_uncategorized_channels():
+    """Channels still waiting for a category, as (id, channel) pairs with id and name only"""
+    if MONGO_ENABLED:
+        cursor = channels_col.find({'needs_category': True}, {'_id': 0, 'id': 1, 'name': 1})
+        return [(ch['id'], ch) for ch in cursor.hint(CHANNEL_INDEXES[1]).batch_size(CURSOR_BATCH_SIZE)]
+    return [(cid, ch) for cid, ch in channels_cache.items() if ch.get('needs_category', False)]
 
 def get_channel(channel_id):
     """Get single channel"""
+    if not MONGO_ENABLED:
+        return channels_cache.get(channel_id)
+    
+    now = time.monotonic()
+    with _channel_cache_lock:
+        hit = _channel_cache.get(channel_id)
+        if hit and now - hit[0] < CHANNEL_CACHE_TTL:
+            _channel_cache.move_to_end(channel_id)
+            return hit[1]
+    
+    channel = channels_col.find_one({'_id': channel_id}, {'_id': 0})
+    if channel is not None:
+        with _channel_cache_lock:
+            _channel_cache[channel_id] = (now, channel)
+            _channel_cache.move_to_end(channel_id)
+            if len(_channel_cache) > CHANNEL_CACHE_SIZE:
+                _channel_cache.popitem(last=False)
+    return channel
+
+# Upserts per bulk_write call when saving imported channels
+SAVE_BATCH = 1000
+
+def save_channels(channels):
+    """Save or update many channels in batched round-trips; returns (new, updated)"""
+    if not channels:
+        return 0, 0
+    # Playlists repeat entries across groups; write each id once (last one wins)
+    unique = list({ch['id']: ch for ch in channels}.values())
+    if len(unique) < len(channels):
+        logger.info("♻️ Skipped %d duplicate channel entries", len(channels) - len(unique))
+        channels = unique
+    new = updated = 0
     if MONGO_ENABLED:
-        return channels_col.find_one({'id': channel_id}, {'_id': 0})
-    return channels_cache.get(channel_id)
-
-def save_channel(channel_data):
-    """Save or update channel"""
+        for start_idx in range(0, len(channels), SAVE_BATCH):
+            try:
+                result = channels_ingest_col.bulk_write(
+                    [UpdateOne({'_id': ch['id']}, {'$set': ch}, upsert=True)
+                     for ch in channels[start_idx:start_idx + SAVE_BATCH]],
+                    ordered=False
+                ).bulk_api_result
+            except BulkWriteError as bwe:
+                # Unordered: every other row in the batch was still written
+                result = bwe.details
+                errors = result['writeErrors']
+                logger.error(f"❌ {len(errors)} channel writes failed: {errors[0]['errmsg']}")
+            new += result['nUpserted']
+            updated += result['nMatched']
+            logger.info("💾 Saved %d/%d channels", min(start_idx + SAVE_BATCH, len(channels)), len(channels))
+    else:
+        for ch in channels:
+            if ch['id'] in channels_cache:
+                updated += 1
+            else:
+                new += 1
+            channels_cache[ch['id']] = ch
+    invalidate_read_cache()
+    return new, updated
+
+def save_categories(assignments):
+    """Write {channel_id: category} results with one bulk update"""
+    if not assignments:
+        return
     if MONGO_ENABLED:
-        channels_col.update_one(
-            {'id': channel_data['id']},
-            {'$set': channel_data},
-            upsert=True
+        channels_col.bulk_write(
+            [UpdateOne({'_id': cid}, {'$set': {'category': cat, 'needs_category': False}})
+             for cid, cat in assignments.items()],
+            ordered=False
         )
     else:
-        channels_cache[channel_data['id']] = channel_data
+        for cid, cat in assignments.items():
+            if cid in channels_cache:
+                channels_cache[cid]['category'] = cat
+                channels_cache[cid]['needs_category'] = False
+    invalidate_read_cache()
 
+@cached_read
 def get_categories():
-    """Get organized categories"""
-    if MONGO_ENABLED:
-        pipeline = [
-            {'$group': {'_id': '$category', 'channels': {'$push': '$id'}, 'count': {'$sum': 1}}},
-            {'$sort': {'_id': 1}}
-        ]
-        result = list(channels_col.aggregate(pipeline))
-        return {item['_id']: item['channels'] for item in result}
-    
-    # Build categories from cache
+    """Memory mode: channel ids grouped by category (MongoDB paths query the index instead)"""
     cats = {}
     for cid, ch in channels_cache.items():
-        cat = ch.get('category', 'Other')
-        if cat not in cats:
-            cats[cat] = []
-        cats[cat].append(cid)
+        cats.setdefault(ch.get('category') or 'Other', []).append(cid)
     return cats
 
-def get_channels_by_category(category):
-    """Get channels in a category"""
+@cached_read
+def get_category_counts():
+    """Get channel count per category (index-served, no id lists)"""
     if MONGO_ENABLED:
-        channels = list(channels_col.find({'category': category}, {'_id': 0}).sort('name', ASCENDING))
-        return channels
+        # One round-trip; the hinted index supplies category without fetching documents
+        pipeline = [{'$group': {'_id': '$category', 'count': {'$sum': 1}}}]
+        # normalize_categories folds None/'' into 'Other' at startup; merge any stragglers
+        counts = Counter()
+        for doc in channels_col.aggregate(pipeline, hint=CHANNEL_INDEXES[0]):
+            counts[doc['_id'] or 'Other'] += doc['count']
+        return counts
+
+    return {cat: len(ids) for cat, ids in get_categories().items()}
+
+def get_channels_by_category(category, skip=0, limit=CHANNELS_PER_PAGE):
+    """Get one page of channels in a category (id and name only)"""
+    if MONGO_ENABLED:
+        # Covered query: filter, sort and both fields come from the compound index (_id is the id)
+        cursor = channels_col.find({'category': category}, {'name': 1}).hint(CHANNEL_INDEXES[0])
+        return [{'id': doc['_id'], 'name': doc['name']}
+                for doc in cursor.sort('name', ASCENDING).skip(skip).limit(limit)]
     cats = get_categories()
-    return [channels_cache.get(cid) for cid in cats.get(category, []) if cid in channels_cache]
+    channels = (channels_cache[cid] for cid in cats.get(category, []) if cid in channels_cache)
+    # Partial sort: only the rows up to the requested page need ordering
+    return heapq.nsmallest(skip + limit, channels, key=lambda ch: ch['name'])[skip:]
+
+def content_digest(content):
+    """128-bit fingerprint of raw source content (XXH3 or BLAKE2b), hashed without re-encoding bytes"""
+    if isinstance(content, str):
+        content = content.encode()
+    if xxhash:
+        # Prefixed so XXH3 keys never collide with BLAKE2b records from hosts without xxhash
+        return b'x3' + xxhash.xxh3_128_digest(content)
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+# Hashes this process claimed recently -> claim time; answers repeat submissions without MongoDB
+RECENT_SOURCES_SIZE = 1024
+_recent_sources = OrderedDict()
+_recent_sources_lock = threading.Lock()
+
+def remember_source(content_hash, processed_at):
+    with _recent_sources_lock:
+        _recent_sources[content_hash] = processed_at
+        _recent_sources.move_to_end(content_hash)
+        if len(_recent_sources) > RECENT_SOURCES_SIZE:
+            _recent_sources.popitem(last=False)
+
+def forget_sources(content_hash=None):
+    """Drop one remembered claim, or all of them (and the recent-URL memo)"""
+    with _recent_sources_lock:
+        if content_hash is None:
+            _recent_sources.clear()
+            _recent_urls.clear()
+        else:
+            _recent_sources.pop(content_hash, None)
 
-def check_source_processed(content):
-    """Check if this source was already processed - DISABLED for testing"""
-    # Temporarily disable duplicate checking to allow re-importing
-    return False
-    
+# (type, url) -> when it last imported successfully; lets a re-pasted URL skip the
+# download within the same window the content-hash check would reject it anyway
+RECENT_URL_TTL = 600
+RECENT_URLS_SIZE = 256
+_recent_urls = OrderedDict()
+
+# Hashes whose claim inserted a brand-new record, so they can't have a checkpoint to resume
+_fresh_sources = set()
+
+def source_now():
+    """Naive UTC timestamp for source records (TTL indexes expire against UTC)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def claim_source(content_hash, source_info, minutes=10):
+    """Claim a source for import; returns processed_at if imported in the last few minutes"""
     if not MONGO_ENABLED:
-        return False
+        return None
+    
+    now = source_now()
+    seen = _recent_sources.get(content_hash)
+    if seen and now - seen < timedelta(minutes=minutes):
+        return seen
+    
+    try:
+        sources_col.insert_one({'hash': content_hash, 'source': source_info, 'processed_at': now})
+        remember_source(content_hash, now)
+        _fresh_sources.add(content_hash)
+        return None
+    except DuplicateKeyError:
+        pass
+    
+    # Known source: re-claim it only if the last import is older than the window
+    stale = sources_col.find_one_and_update(
+        {'hash': content_hash, 'processed_at': {'$lt': now - timedelta(minutes=minutes)}},
+        {'$set': {'source': source_info, 'processed_at': now}},
+        projection={'_id': 1}
+    )
+    if stale:
+        remember_source(content_hash, now)
+        return None
     
-    content_hash = hashlib.md5(content.encode()).hexdigest()
-    return sources_col.find_one({'hash': content_hash}) is not None
+    recent = sources_col.find_one({'hash': content_hash}, {'_id': 0, 'processed_at': 1})
+    processed_at = recent['processed_at'] if recent else now
+    remember_source(content_hash, processed_at)
+    return processed_at
 
-def mark_source_processed(content, source_info):
-    """Mark source as processed"""
+def release_source(content_hash):
+    """Drop a claim whose import failed so the source can be retried"""
+    forget_sources(content_hash)
+    _fresh_sources.discard(content_hash)
+    if MONGO_ENABLED:
+        sources_col.delete_one({'hash': content_hash})
+
+def mark_source_processed(content_hash, source_info, **details):
+    """Mark source as processed, recording import counts passed by the caller"""
+    # The import is finished, so its claim is no longer fresh (JSON imports never
+    # ask source_checkpoint, and the hash must not outlive the import)
+    _fresh_sources.discard(content_hash)
     if not MONGO_ENABLED:
         return
     
-    content_hash = hashlib.md5(content.encode()).hexdigest()
-    sources_col.update_one(
+    source_marks_col.update_one(
         {'hash': content_hash},
         {'$set': {
             'hash': content_hash,
             'source': source_info,
-            'processed_at': datetime.now(),
-            'channel_count': len(json.loads(content)) if isinstance(content, str) else 0
+            'processed_at': source_now(),
+            'partial': False,
+            **details
         }},
         upsert=True
     )
 
+# Channels saved between import checkpoints; a crash re-saves at most this many
+IMPORT_CHECKPOINT = 1000
+
+def checkpoint_source(content_hash, saved_upto):
+    """Record how far a running import has saved, so a crashed one can resume"""
+    if MONGO_ENABLED:
+        source_marks_col.update_one(
+            {'hash': content_hash},
+            {'$set': {'partial': True, 'checkpoint_idx': saved_upto}}
+        )
+
+def source_checkpoint(content_hash):
+    """Channels already saved by an unfinished earlier import of this source (0 if none)"""
+    if not MONGO_ENABLED:
+        return 0
+    # A claim that created the record proves there is no earlier import to resume
+    if content_hash in _fresh_sources:
+        _fresh_sources.discard(content_hash)
+        return 0
+    doc = sources_col.find_one({'hash': content_hash, 'partial': True}, {'_id': 0, 'checkpoint_idx': 1})
+    return doc['checkpoint_idx'] if doc else 0
+
+# Stat increments are buffered here and written by flush_stats_loop
+STATS_FLUSH_INTERVAL = 5
+_pending_stats = Counter()
+_stats_lock = threading.Lock()
+
 def update_stats(stat_type, value=1):
     """Update bot statistics"""
     if MONGO_ENABLED:
-        stats_col.update_one(
-            {'type': stat_type},
-            {'$inc': {'value': value}, '$set': {'updated_at': datetime.now()}},
-            upsert=True
-        )
+        with _stats_lock:
+            _pending_stats[stat_type] += value
     else:
         if stat_type == 'plays':
             bot_stats['total_plays'] += value
         elif stat_type == 'users':
             bot_stats['total_users'].add(value)
 
+def flush_stats():
+    """Write buffered stat increments with one $inc per stat type"""
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    
+    now = datetime.now()
+    for stat_type, value in pending.items():
+        stats_col.update_one(
+            {'type': stat_type},
+            {'$inc': {'value': value}, '$set': {'updated_at': now}},
+            upsert=True
+        )
+
+async def flush_stats_loop():
+    """Periodically flush buffered stats off the event loop"""
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_stats)
+        except Exception as e:
+            logger.error(f"Stats flush error: {e}")
+
+# Set on shutdown to end the change-stream watcher thread
+_watch_stop = threading.Event()
+
+def watch_channel_changes():
+    """Invalidate local read caches on any channel change, including other instances' writes"""
+    while not _watch_stop.is_set():
+        try:
+            # Database-level stream survives collection drops from admin clear
+            with db.watch([{'$match': {'ns.coll': 'channels'}}], max_await_time_ms=1000) as stream:
+                while stream.alive and not _watch_stop.is_set():
+                    if stream.try_next() is not None:
+                        # Drain the rest of the burst so a bulk import invalidates
+                        # once instead of once per written document
+                        while not _watch_stop.is_set() and stream.try_next() is not None:
+                            pass
+                        invalidate_read_cache()
+            invalidate_read_cache()
+        except OperationFailure as e:
+            # Standalone servers have no change streams; caches stay local-only
+            logger.warning(f"⚠️ Change streams unavailable, cross-instance cache sync disabled: {e}")
+            return
+        except PyMongoError as e:
+            logger.error(f"Change stream error: {e}")
+            _watch_stop.wait(5)
+
+@cached_read
+def get_channel_totals():
+    """Channel and category totals; cached until the next channel write"""
+    if MONGO_ENABLED:
+        # Collection metadata count, no scan of the channels collection
+        return {
+            'channels': channels_col.estimated_document_count(),
+            'categories': len(get_category_counts())
+        }
+    return {'channels': len(channels_cache), 'categories': len(get_categories())}
+
+@cached_read(ttl=READ_CACHE_TTL)
 def get_stats():
     """Get bot statistics"""
+    totals = get_channel_totals()
     if MONGO_ENABLED:
-        total_channels = channels_col.count_documents({})
-        total_categories = len(get_categories())
-        plays = stats_col.find_one({'type': 'plays'})
-        users = stats_col.find_one({'type': 'users'})
+        # Both counters in one round-trip
+        counters = {doc['type']: doc['value'] for doc in
+                    stats_col.find({'type': {'$in': ['plays', 'users']}}, {'_id': 0, 'type': 1, 'value': 1})}
         
         return {
-            'channels': total_channels,
-            'categories': total_categories,
-            'plays': plays['value'] if plays else 0,
-            'users': users['value'] if users else 0
+            **totals,
+            'plays': counters.get('plays', 0),
+            'users': counters.get('users', 0)
         }
     else:
         return {
-            'channels': len(channels_cache),
-            'categories': len(get_categories()),
+            **totals,
             'plays': bot_stats['total_plays'],
             'users': len(bot_stats['total_users'])
         }
 
 # ============= M3U PARSING =============
 
-def parse_m3u_content(content, base_url=''):
-    """Parse M3U/M3U8 playlist content with better error handling"""
-    channels = []
-    lines = content.strip().split('\n')
-    
-    logger.info(f"📝 Parsing M3U content ({len(lines)} lines)")
+# EXTINF attributes we read, matched in a single pass per line
+EXTINF_ATTR_RE = re.compile(r'(tvg-id|tvg-name|tvg-logo|group-title)="([^"]*)"')
+# Stream URLs with one of these schemes are absolute; anything else is joined to base_url
+ABSOLUTE_URL_PREFIXES = ('http://', 'https://', 'rtmp://', 'rtsp://')
+
+def iter_m3u_channels(content, base_url=''):
+    """Yield channels from M3U/M3U8 playlist content (text or raw UTF-8 bytes) as each stream URL is reached"""
+    raw = not isinstance(content, str)
+    logger.info(f"📝 Parsing M3U content ({len(content)} {'bytes' if raw else 'chars'})")
     
     current_channel = {}
     
-    for i, line in enumerate(lines):
+    # Read lines lazily instead of materializing a list of every line up front. Raw
+    # bytes are decoded a line at a time: decoding the whole body and wrapping it in
+    # StringIO holds a 4-byte-per-char copy of the playlist for the entire parse
+    for i, line in enumerate(io.BytesIO(content) if raw else io.StringIO(content)):
+        if raw:
+            line = line.decode('utf-8', errors='replace')
         line = line.strip()
+        if not line:
+            continue
         
-        # Skip empty lines and comments (except EXTINF)
-        if not line or (line.startswith('#') and not line.startswith('#EXTINF')):
+        # One first-character test sorts tags from URLs; tags other than EXTINF are skipped
+        is_tag = line[0] == '#'
+        if is_tag and not line.startswith('#EXTINF:'):
             continue
         
-        if line.startswith('#EXTINF:'):
+        if is_tag:
             # Parse channel info
             # Format: #EXTINF:-1 tvg-id="id" tvg-name="name" tvg-logo="logo" group-title="category",Channel Name
             
-            # Extract attributes using regex
-            tvg_id_match = re.search(r'tvg-id="([^"]*)"', line)
-            tvg_name_match = re.search(r'tvg-name="([^"]*)"', line)
-            tvg_logo_match = re.search(r'tvg-logo="([^"]*)"', line)
-            group_match = re.search(r'group-title="([^"]*)"', line)
+            # Extract all attributes in one scan of the line; bare "#EXTINF:-1,Name"
+            # lines have no quotes and skip the regex entirely
+            last_quote = line.rfind('"')
+            attrs = dict(EXTINF_ATTR_RE.findall(line)) if last_quote >= 0 else {}
             
-            # Extract channel name (after last comma)
-            name_match = re.search(r',(.+)$', line)
+            # Channel name follows the first comma after the last quoted attribute,
+            # so commas inside attribute values (logo URLs) don't cut it short
+            _, sep, tail = line[last_quote + 1:].partition(',')
             
             # Generate unique ID
-            ch_name = name_match.group(1).strip() if name_match else (tvg_name_match.group(1) if tvg_name_match else f"Channel {i}")
-            ch_id = tvg_id_match.group(1) if tvg_id_match and tvg_id_match.group(1) else f"ch_{hashlib.md5(ch_name.encode()).hexdigest()[:8]}"
+            ch_name = tail.strip() if sep and tail else attrs.get('tvg-name', f"Channel {i}")
+            ch_id = attrs.get('tvg-id') or f"ch_{hashlib.md5(ch_name.encode(), usedforsecurity=False).hexdigest()[:8]}"
             
             current_channel = {
                 'id': ch_id,
                 'name': ch_name,
-                'logo': tvg_logo_match.group(1) if tvg_logo_match else '',
-                'category': group_match.group(1) if group_match else None,
+                'logo': attrs.get('tvg-logo', ''),
+                'category': attrs.get('group-title'),
             }
             
-        elif line and not line.startswith('#') and current_channel:
-            # This is the stream URL
-            stream_url = line.strip()
+        elif current_channel:
+            # This is the stream URL (already stripped)
+            stream_url = line
             
             # Handle relative URLs
-            if base_url and not stream_url.startswith(('http://', 'https://', 'rtmp://', 'rtsp://')):
+            if base_url and not stream_url.startswith(ABSOLUTE_URL_PREFIXES):
                 stream_url = urljoin(base_url, stream_url)
             
             current_channel['link'] = stream_url
             
-            # Detect stream type and proxy requirements
-            if '.m3u8' in stream_url.lower():
-                current_channel['stream_type'] = 'hls'
-            elif '.mpd' in stream_url.lower():
-                current_channel['stream_type'] = 'dash'
-            else:
-                current_channel['stream_type'] = 'hls'  # Default
+            # Detect stream type (HLS unless it's a DASH manifest) and proxy requirements
+            lowered = stream_url.lower()
+            current_channel['stream_type'] = 'dash' if '.mpd' in lowered and '.m3u8' not in lowered else 'hls'
             
             # Detect if it needs special handling
             if 'servertvhub.site' in stream_url:
                 current_channel['needs_proxy'] = True
-                logger.info(f"  🔍 ServerTVHub URL detected: {stream_url}")
+                logger.debug("  🔍 ServerTVHub URL detected: %s", stream_url)
                 
                 # If it's a PHP endpoint, mark it specially
                 if '.php' in stream_url:
                     current_channel['is_php_endpoint'] = True
-                    logger.info(f"  ⚙️ PHP endpoint detected - will fetch actual stream")
+                    logger.debug("  ⚙️ PHP endpoint detected - will fetch actual stream")
             elif 'live.php' in stream_url or 'playlist.php' in stream_url:
                 current_channel['needs_proxy'] = True
                 current_channel['is_php_endpoint'] = True
             
-            channels.append(current_channel.copy())
-            logger.info(f"  ✓ Parsed: {current_channel['name']} ({current_channel.get('stream_type', 'unknown')})")
+            logger.debug("  ✓ Parsed: %s (%s)", current_channel['name'], current_channel['stream_type'])
+            yield current_channel
             current_channel = {}
-    
+
+def parse_m3u_content(content, base_url=''):
+    """Parse M3U/M3U8 playlist content into a list of channels"""
+    channels = list(iter_m3u_channels(content, base_url))
     logger.info(f"✅ Parsed {len(channels)} channels from M3U")
     return channels
 
+# A JSON document opens with [ or { after optional whitespace; match() reads no further
+JSON_START_RE = re.compile(r'\s*[\[{]')
+
 def parse_servertvhub_playlist(content, base_url):
     """Parse servertvhub.site style playlist with better error handling"""
     channels = []
@@ -294,35 +800,15 @@ def parse_servertvhub_playlist(content, base_url):
     
     # Try to extract channel data from PHP response
     try:
-        # First, try JSON format
-        try:
-            data = json.loads(content)
-            logger.info(f"✅ Parsed as JSON, found {len(data) if isinstance(data, list) else 'unknown'} items")
+        # First, try JSON format; M3U bodies (the usual case) can't open with [ or {,
+        # so they go straight to the M3U parser without a failed parse attempt
+        if JSON_START_RE.match(content):
+            try:
+                data = json_loads(content)
+                logger.info(f"✅ Parsed as JSON, found {len(data) if isinstance(data, list) else 'unknown'} items")
             
-            if isinstance(data, list):
-                for idx, item in enumerate(data):
-                    try:
-                        channel = {
-                            'id': item.get('id', f"stv_{idx}"),
-                            'name': item.get('name', item.get('title', f'Channel {idx}')),
-                            'logo': item.get('logo', item.get('image', '')),
-                            'link': item.get('url', item.get('link', item.get('stream_url', ''))),
-                            'category': item.get('category', item.get('group', None)),
-                            'needs_proxy': True
-                        }
-                        
-                        # Make sure we have at least a name and link
-                        if channel['name'] and channel['link']:
-                            channels.append(channel)
-                            logger.info(f"  ✓ Added: {channel['name']}")
-                    except Exception as e:
-                        logger.error(f"  ✗ Error parsing item {idx}: {e}")
-                        continue
-                        
-            elif isinstance(data, dict):
-                # Handle dict with channels key
-                if 'channels' in data:
-                    for idx, item in enumerate(data['channels']):
+                if isinstance(data, list):
+                    for idx, item in enumerate(data):
                         try:
                             channel = {
                                 'id': item.get('id', f"stv_{idx}"),
@@ -332,19 +818,40 @@ def parse_servertvhub_playlist(content, base_url):
                                 'category': item.get('category', item.get('group', None)),
                                 'needs_proxy': True
                             }
-                            
+                        
+                            # Make sure we have at least a name and link
                             if channel['name'] and channel['link']:
                                 channels.append(channel)
-                                logger.info(f"  ✓ Added: {channel['name']}")
+                                logger.debug("  ✓ Added: %s", channel['name'])
                         except Exception as e:
-                            logger.error(f"  ✗ Error parsing channel {idx}: {e}")
+                            logger.error(f"  ✗ Error parsing item {idx}: {e}")
                             continue
+                        
+                elif isinstance(data, dict):
+                    # Handle dict with channels key
+                    if 'channels' in data:
+                        for idx, item in enumerate(data['channels']):
+                            try:
+                                channel = {
+                                    'id': item.get('id', f"stv_{idx}"),
+                                    'name': item.get('name', item.get('title', f'Channel {idx}')),
+                                    'logo': item.get('logo', item.get('image', '')),
+                                    'link': item.get('url', item.get('link', item.get('stream_url', ''))),
+                                    'category': item.get('category', item.get('group', None)),
+                                    'needs_proxy': True
+                                }
                             
-            return channels
+                                if channel['name'] and channel['link']:
+                                    channels.append(channel)
+                                    logger.debug("  ✓ Added: %s", channel['name'])
+                            except Exception as e:
+                                logger.error(f"  ✗ Error parsing channel {idx}: {e}")
+                                continue
+                            
+                return channels
             
-        except json.JSONDecodeError:
-            logger.info("⚠️ Not JSON format, trying M3U format")
-            pass
+            except json.JSONDecodeError:
+                logger.info("⚠️ Not JSON format, trying M3U format")
         
         # If not JSON, try M3U format
         channels = parse_m3u_content(content, base_url)
@@ -357,69 +864,121 @@ def parse_servertvhub_playlist(content, base_url):
         return channels
         
     except Exception as e:
-        logger.error(f"❌ Error parsing servertvhub playlist: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"❌ Error parsing servertvhub playlist: {e}")
         return []
 
-# ============= FLASK ROUTES =============
+# ============= WEB ROUTES =============
+
+def json_response(data):
+    """JSON response encoded with json_dumps (drop-in for jsonify)"""
+    return Response(json_dumps(data), mimetype='application/json')
 
 @app.route('/')
-def index():
-    channels = list(get_all_channels().values())
-    categories = get_categories()
-    return render_template('index.html', channels=channels, categories=categories)
+async def index():
+    # The landing page is static; its counters come from /health on the client
+    return await render_template('index.html')
 
 @app.route('/player')
-def player():
+async def player():
     channel_id = request.args.get('id', '')
-    channel = get_channel(channel_id)
+    channel = await run_db(get_channel, channel_id)
     
     if not channel:
         return "Channel not found", 404
     
     update_stats('plays', 1)
-    return render_template('player.html', channel=channel, webapp_url=WEBAPP_URL)
+    return await render_template('player.html', channel=channel, webapp_url=WEBAPP_URL)
+
+# Opening <BaseURL> tag in a DASH manifest, optionally namespaced or with attributes
+BASEURL_TAG_RE = re.compile(rb'<(?:[\w.-]+:)?BaseURL\b[^>]*>')
+# Start of a relative URI in an HLS playlist: a bare URI line, or a tag's URI="..."
+# attribute (#EXT-X-KEY, -MAP, -MEDIA); root paths and absolute/scheme URIs are left alone
+HLS_RELATIVE_URI_RE = re.compile(
+    rb'(?:^(?=[^#/\s])|(?<=URI=")(?=[^/"]))(?![a-zA-Z][\w+.-]*:)', re.M
+)
+
+DASH_MIMETYPE = 'application/dash+xml'
+HLS_MIMETYPE = 'application/vnd.apple.mpegurl'
+
+# Rewritten live manifests, shared by every viewer of a channel for a few seconds
+MANIFEST_CACHE_TTL = 3
+MANIFEST_CACHE_SIZE = 1024
+_manifest_cache = OrderedDict()
+_manifest_cache_lock = threading.Lock()
+
+def cache_manifest(key, content, etag, mimetype):
+    """Store a rewritten manifest with its fetch time, upstream ETag and type"""
+    with _manifest_cache_lock:
+        _manifest_cache[key] = (time.monotonic(), content, etag, mimetype)
+        _manifest_cache.move_to_end(key)
+        if len(_manifest_cache) > MANIFEST_CACHE_SIZE:
+            _manifest_cache.popitem(last=False)
 
 @app.route('/proxy/<channel_id>')
-def proxy_manifest(channel_id):
+async def proxy_manifest(channel_id):
     """Proxy DASH/HLS manifest with cookies"""
     try:
-        channel = get_channel(channel_id)
+        channel = await run_db(get_channel, channel_id)
         if not channel:
-            return jsonify({'error': 'Channel not found'}), 404
+            return json_response({'error': 'Channel not found'}), 404
         
         manifest_url = channel.get('link', '')
         cookie = channel.get('cookie', '')
         
         if not manifest_url:
-            return jsonify({'error': 'No manifest URL'}), 400
+            return json_response({'error': 'No manifest URL'}), 400
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Referer': 'https://www.jiocinema.com/',
-            'Origin': 'https://www.jiocinema.com'
-        }
-        
-        if cookie:
-            headers['Cookie'] = cookie
-        
-        response = requests.get(manifest_url, headers=headers, timeout=10)
-        
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch manifest: {response.status_code}")
-            return jsonify({'error': f'Manifest fetch failed: {response.status_code}'}), 502
-        
-        content = response.text
-        content_type = 'application/dash+xml' if '.mpd' in manifest_url else 'application/vnd.apple.mpegurl'
-        
-        # Modify URLs to use proxy
-        if channel.get('needs_proxy'):
-            content = content.replace('BaseURL>', f'BaseURL>{WEBAPP_URL}/proxy-segment/{channel_id}/')
+        key = (channel_id, manifest_url)
+        cached = _manifest_cache.get(key)
+        if cached and time.monotonic() - cached[0] < MANIFEST_CACHE_TTL:
+            content, mimetype = cached[1], cached[3]
+        else:
+            headers = {'Cookie': cookie} if cookie else {}
+            if cached and cached[2]:
+                headers['If-None-Match'] = cached[2]
+            
+            # Pooled async fetch: players poll manifests constantly, so don't hold a worker thread
+            async with SEGMENT_SESSION.get(
+                manifest_url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                status = response.status
+                etag = response.headers.get('ETag')
+                upstream_type = response.headers.get('Content-Type', '').lower()
+                body = await response.read() if status == 200 else None
+            
+            if status == 304 and cached:
+                content, mimetype = cached[1], cached[3]
+            elif status != 200:
+                logger.error(f"Failed to fetch manifest: {status}")
+                return json_response({'error': f'Manifest fetch failed: {status}'}), 502
+            else:
+                content = body
+                # Type from the upstream Content-Type, then the URL's extension, and only
+                # then what the import recorded (JSON imports default stream_type to dash)
+                link = manifest_url.lower()
+                if 'dash' in upstream_type:
+                    mimetype = DASH_MIMETYPE
+                elif 'mpegurl' in upstream_type:
+                    mimetype = HLS_MIMETYPE
+                elif '.m3u8' in link:
+                    mimetype = HLS_MIMETYPE
+                elif '.mpd' in link:
+                    mimetype = DASH_MIMETYPE
+                else:
+                    mimetype = DASH_MIMETYPE if channel.get('stream_type', 'dash') == 'dash' else HLS_MIMETYPE
+                # Point segment URLs at the proxy, rewritten on raw bytes in one pass
+                if channel.get('needs_proxy'):
+                    prefix = f'{WEBAPP_URL}/proxy-segment/{channel_id}/'.encode()
+                    if mimetype == DASH_MIMETYPE:
+                        content = BASEURL_TAG_RE.sub(lambda m: m.group(0) + prefix, content)
+                    else:
+                        content = HLS_RELATIVE_URI_RE.sub(lambda m: prefix, content)
+            
+            cache_manifest(key, content, etag or (cached and cached[2]), mimetype)
         
         return Response(
             content,
-            mimetype=content_type,
+            mimetype=mimetype,
             headers={
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
@@ -430,15 +989,15 @@ def proxy_manifest(channel_id):
         
     except Exception as e:
         logger.error(f"Proxy error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}), 500
 
 @app.route('/proxy-segment/<channel_id>/<path:segment_path>')
-def proxy_segment(channel_id, segment_path):
+async def proxy_segment(channel_id, segment_path):
     """Proxy video segments with cookies"""
     try:
-        channel = get_channel(channel_id)
+        channel = await run_db(get_channel, channel_id)
         if not channel:
-            return jsonify({'error': 'Channel not found'}), 404
+            return json_response({'error': 'Channel not found'}), 404
         
         manifest_url = channel.get('link', '')
         cookie = channel.get('cookie', '')
@@ -446,45 +1005,70 @@ def proxy_segment(channel_id, segment_path):
         manifest_base = manifest_url.rsplit('/', 1)[0] + '/'
         segment_url = urljoin(manifest_base, segment_path)
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Referer': 'https://www.jiocinema.com/',
-            'Origin': 'https://www.jiocinema.com'
-        }
+        headers = {'Cookie': cookie} if cookie else None
         
-        if cookie:
-            headers['Cookie'] = cookie
+        async def stream_body():
+            # The upstream response lives inside the generator, so aclose() releases its
+            # pooled connection however the request ends; the first yield hands it out
+            async with SEGMENT_SESSION.get(
+                segment_url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=10)
+            ) as upstream:
+                yield upstream
+                # Forward buffers as they arrive instead of re-slicing them
+                async for chunk in upstream.content.iter_any():
+                    yield chunk
         
-        response = requests.get(segment_url, headers=headers, stream=True, timeout=10)
+        # Started here, so even a body the client never reads is closed by aclose()
+        body = stream_body()
+        response = await body.__anext__()
         
-        if response.status_code != 200:
-            logger.error(f"Segment fetch failed: {response.status_code}")
-            return jsonify({'error': 'Segment fetch failed'}), 502
+        if response.status != 200:
+            logger.error(f"Segment fetch failed: {response.status}")
+            await body.aclose()
+            return json_response({'error': 'Segment fetch failed'}), 502
         
-        return Response(
-            response.iter_content(chunk_size=8192),
-            mimetype=response.headers.get('Content-Type', 'video/mp4'),
-            headers={
+        try:
+            upstream_type = response.headers.get('Content-Type', '')
+            # Variant playlists of a rewritten master come through here too; a live
+            # playlist must be refetched, only media segments are immutable
+            is_playlist = 'mpegurl' in upstream_type.lower() or segment_path.lower().endswith('.m3u8')
+            headers = {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
                 'Access-Control-Allow-Headers': 'Range, Content-Type',
                 'Access-Control-Expose-Headers': 'Content-Length, Content-Range',
-                'Cache-Control': 'public, max-age=3600'
+                'Cache-Control': 'no-cache' if is_playlist else 'public, max-age=3600'
             }
-        )
+            # aiohttp decodes compressed bodies, so only a plain length is still valid
+            if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+                headers['Content-Length'] = response.headers['Content-Length']
+            
+            return Response(
+                body,
+                mimetype=upstream_type or 'video/mp4',
+                headers=headers
+            )
+        except BaseException:
+            await body.aclose()
+            raise
         
     except Exception as e:
         logger.error(f"Segment proxy error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}), 500
+
+# First HLS/DASH URL embedded in an HTML/text response
+STREAM_URL_RE = re.compile(r'https?://[^\s<>"]+\.(?:m3u8|mpd)[^\s<>"]*')
 
 @app.route('/api/fetch-stream')
-def fetch_stream():
+async def fetch_stream():
     """Fetch actual stream URL from servertvhub.site PHP endpoints"""
     try:
         url = request.args.get('url', '')
         
         if not url:
-            return jsonify({'error': 'No URL provided'}), 400
+            return json_response({'error': 'No URL provided'}), 400
         
         logger.info(f"🔍 Fetching stream from: {url}")
         
@@ -498,23 +1082,27 @@ def fetch_stream():
             'X-Requested-With': 'XMLHttpRequest'
         }
         
-        # Fetch the PHP endpoint
-        response = requests.get(url, headers=headers, timeout=15)
+        # Fetch the PHP endpoint over the pooled async session
+        async with SEGMENT_SESSION.get(
+            url, headers=headers, timeout=aiohttp.ClientTimeout(total=15)
+        ) as response:
+            status = response.status
+            body = await response.read()
         
-        if response.status_code != 200:
-            logger.error(f"❌ Failed to fetch: HTTP {response.status_code}")
-            return jsonify({'error': f'HTTP {response.status_code}'}), response.status_code
+        if status != 200:
+            logger.error(f"❌ Failed to fetch: HTTP {status}")
+            return json_response({'error': f'HTTP {status}'}), status
         
-        content = response.text
+        content = body.decode('utf-8', errors='replace')
         logger.info(f"✅ Received response ({len(content)} bytes)")
         
         # Try to parse as JSON first
         try:
-            data = response.json()
+            data = json_loads(body)
             logger.info(f"📦 Parsed as JSON: {data}")
             
             # Return the JSON data - let the frontend extract the URL
-            return jsonify(data), 200
+            return json_response(data), 200
             
         except json.JSONDecodeError:
             # If not JSON, might be plain text URL
@@ -522,123 +1110,337 @@ def fetch_stream():
             
             # Check if it's a direct stream URL
             if content.strip().startswith('http') and ('.m3u8' in content or '.mpd' in content):
-                return jsonify({'url': content.strip()}), 200
+                return json_response({'url': content.strip()}), 200
             
             # Try to extract URL from HTML/text
-            import re
-            url_pattern = r'https?://[^\s<>"]+\.(?:m3u8|mpd)[^\s<>"]*'
-            urls = re.findall(url_pattern, content)
+            url_match = STREAM_URL_RE.search(content)
             
-            if urls:
-                logger.info(f"🔗 Extracted URL: {urls[0]}")
-                return jsonify({'url': urls[0]}), 200
+            if url_match:
+                logger.info(f"🔗 Extracted URL: {url_match.group(0)}")
+                return json_response({'url': url_match.group(0)}), 200
             
             logger.error(f"❌ Could not extract stream URL from response")
-            return jsonify({
+            return json_response({
                 'error': 'Could not extract stream URL',
                 'content_preview': content[:200]
             }), 400
             
-    except requests.Timeout:
+    except asyncio.TimeoutError:
         logger.error(f"⏱️ Timeout fetching stream")
-        return jsonify({'error': 'Request timeout'}), 504
+        return json_response({'error': 'Request timeout'}), 504
     except Exception as e:
         logger.error(f"❌ Error fetching stream: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}), 500
+
+# Encoded /api/channels body with the read-cache generation it was built from
+_api_channels_body = None
+# Lets browsers/CDNs coalesce repeat channel-list fetches
+API_CHANNELS_HEADERS = {'Cache-Control': 'public, max-age=30'}
 
 @app.route('/api/channels')
-def api_channels():
-    channels = get_all_channels()
-    formatted = []
-    
-    for cid, ch in channels.items():
-        formatted.append({
-            'id': cid,
-            'name': ch['name'],
-            'logo': ch.get('logo', ''),
-            'link': ch.get('link', ''),
-            'category': ch.get('category', 'Other'),
-            'stream_type': ch.get('stream_type', 'dash')
-        })
-    
-    return jsonify(formatted)
+async def api_channels():
+    gen = _read_cache_gen
+    if _api_channels_body and _api_channels_body[0] == gen:
+        return Response(_api_channels_body[1], mimetype='application/json', headers=API_CHANNELS_HEADERS)
+    channels = list_channels_summary()
+    
+    async def generate():
+        global _api_channels_body
+        # Pull one batch at a time off the event loop and encode it as one chunk
+        chunks = []
+        sep = b'['
+        while True:
+            batch = await run_db(list, itertools.islice(channels, CURSOR_BATCH_SIZE))
+            if not batch:
+                break
+            chunk = sep + b','.join(json_dumps({
+                'id': ch['id'],
+                'name': ch['name'],
+                'logo': ch.get('logo', ''),
+                'link': ch.get('link', ''),
+                'category': ch.get('category', 'Other'),
+                'stream_type': ch.get('stream_type', 'dash')
+            }) for ch in batch)
+            chunks.append(chunk)
+            yield chunk
+            sep = b','
+        chunk = b']' if sep == b',' else b'[]'
+        chunks.append(chunk)
+        yield chunk
+        # Keep the full body for later requests unless channels changed mid-stream
+        if gen == _read_cache_gen:
+            _api_channels_body = (gen, b''.join(chunks))
+    
+    return Response(generate(), mimetype='application/json', headers=API_CHANNELS_HEADERS)
+
+@app.route('/ping')
+async def ping():
+    """Liveness probe for hosting keep-alive checks; no DB or stats work"""
+    return 'ok'
 
 @app.route('/health')
-def health():
-    stats = get_stats()
-    return jsonify({
+async def health():
+    stats = await run_db(get_stats)
+    return json_response({
         'status': 'ok',
         'mongodb': MONGO_ENABLED,
         'gemini': gemini_model is not None,
         **stats
     })
 
-def run_flask():
-    app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+# Set by post_init so the webhook route can hand updates to the bot
+BOT_APP = None
+
+@app.route('/telegram', methods=['POST'])
+async def telegram_webhook():
+    """Webhook mode: queue an update pushed by Telegram"""
+    if not USE_WEBHOOK or BOT_APP is None:
+        return Response(status=404)
+    if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return Response(status=403)
+    data = await request.get_json(force=True)
+    await BOT_APP.update_queue.put(Update.de_json(data, BOT_APP.bot))
+    return Response(status=200)
+
+async def serve_web(shutdown_trigger):
+    """Serve the Quart app with Hypercorn until shutdown_trigger resolves"""
+    config = HypercornConfig()
+    config.bind = [f'0.0.0.0:{PORT}']
+    # Long-lived segment streams must not hold up bot shutdown indefinitely
+    config.graceful_timeout = 5
+    config.keep_alive_timeout = 30
+    await serve(app, config, shutdown_trigger=shutdown_trigger)
+
+_web_shutdown = None
+_web_task = None
+
+async def start_web():
+    """Run the web server as a task on the bot's event loop"""
+    global _web_shutdown, _web_task
+    _web_shutdown = asyncio.Event()
+    _web_task = asyncio.create_task(serve_web(_web_shutdown.wait))
+
+async def stop_web():
+    """Let Hypercorn finish in-flight requests, then wait for it to exit"""
+    if _web_task:
+        _web_shutdown.set()
+        # A server that already crashed must not stop the rest of the teardown
+        try:
+            await _web_task
+        except Exception as e:
+            logger.exception(f"❌ Web server error: {e}")
+            # A server that died after startup never ran after_serving
+            await close_segment_session()
 
 # ============= AI CATEGORIZATION =============
 
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
-async def categorize_with_ai(channel_name):
-    """Smart categorization with Gemini or fallback"""
+# Gemini fan-out: parallel requests in flight, and a global request rate
+# (at least 1 each: 0 would hang on Semaphore(0) or divide by zero per batch)
+AI_CONCURRENCY = max(1, int(os.environ.get('AI_CONCURRENCY', 10)))
+AI_REQUESTS_PER_MINUTE = max(1, int(os.environ.get('AI_REQUESTS_PER_MINUTE', 60)))
+_ai_next_slot = 0.0
+
+async def wait_for_ai_slot():
+    """Space Gemini calls evenly to stay within AI_REQUESTS_PER_MINUTE"""
+    global _ai_next_slot
+    now = asyncio.get_running_loop().time()
+    slot = max(now, _ai_next_slot)
+    _ai_next_slot = slot + 60 / AI_REQUESTS_PER_MINUTE
+    await asyncio.sleep(slot - now)
+
+def category_key(channel_name):
+    """Normalize a channel name so spacing/case/punctuation variants share a cache entry"""
+    # Keep letters, combining marks and digits of any script, so Devanagari/Tamil names
+    # get distinct keys instead of collapsing to ''
+    return ''.join(c for c in channel_name.casefold() if unicodedata.category(c)[0] in 'LMN')
+
+def lookup_ai_categories(keys):
+    """Previously stored Gemini categories for normalized names (None where unknown)"""
+    # An empty key (all-punctuation name) would alias unrelated channels; never cache it
+    missing = [k for k in set(keys) if k and k not in ai_category_cache]
+    if missing and MONGO_ENABLED:
+        for doc in categorizations_col.find({'_id': {'$in': missing}}, {'category': 1}):
+            ai_category_cache[doc['_id']] = doc['category']
+    return [ai_category_cache.get(k) if k else None for k in keys]
+
+def store_ai_categories(assignments):
+    """Remember {normalized name: category} answers from Gemini"""
+    assignments = {key: cat for key, cat in assignments.items() if key}
+    if not assignments:
+        return
+    ai_category_cache.update(assignments)
+    if MONGO_ENABLED:
+        categorizations_col.bulk_write(
+            [UpdateOne({'_id': key}, {'$set': {'category': cat}}, upsert=True)
+             for key, cat in assignments.items()],
+            ordered=False
+        )
+
+# Channel names sent to Gemini per prompt
+AI_BATCH_SIZE = 50
+VALID_CATEGORIES = ['Sports', 'News', 'Entertainment', 'Movies', 'Music', 'Kids',
+                    'Documentary', 'Religious', 'Regional', 'Other']
+
+async def categorize_with_ai_batch(channel_names):
+    """Categorize a group of channels with one Gemini prompt; keyword fallback per name"""
+    results = [None] * len(channel_names)
     if gemini_model:
-        try:
-            prompt = f"""Categorize this TV channel into EXACTLY ONE category from this list:
-Sports, News, Entertainment, Movies, Music, Kids, Documentary, Religious, Regional, Other
+        keys = [category_key(name) for name in channel_names]
+        results = await run_db(lookup_ai_categories, keys)
+        # Ask once per normalized name; repeats within the group share the answer.
+        # An empty key says nothing about the name, so each of those is asked on its own
+        first = {}
+        misses = [i for i, category in enumerate(results)
+                  if not category and (not keys[i] or first.setdefault(keys[i], i) == i)]
+        
+        if misses:
+            try:
+                listing = "\n".join(f"{n}. {channel_names[i]}" for n, i in enumerate(misses, 1))
+                prompt = f"""Categorize each TV channel below into EXACTLY ONE category from this list:
+{', '.join(VALID_CATEGORIES)}
 
-Channel: {channel_name}
+Channels:
+{listing}
 
-Respond with ONLY the category name."""
-            
-            response = await asyncio.to_thread(gemini_model.generate_content, prompt)
-            category = response.text.strip()
-            
-            valid = ['Sports', 'News', 'Entertainment', 'Movies', 'Music', 'Kids', 
-                    'Documentary', 'Religious', 'Regional', 'Other']
-            
-            if category in valid:
-                return category
-        except Exception as e:
-            logger.error(f"Gemini error: {e}")
-    
-    return categorize_basic(channel_name)
+Respond with ONLY a JSON array of category names, one per channel, in the same order."""
+                
+                await wait_for_ai_slot()
+                # Native async call: concurrent prompts don't occupy the DB worker threads
+                response = await gemini_model.generate_content_async(prompt)
+                # Tolerate the model wrapping its answer in a ```json fence
+                answer = json_loads(response.text.strip().strip('`').removeprefix('json'))
+                
+                if isinstance(answer, list) and len(answer) == len(misses):
+                    answered = {i: category for i, category in zip(misses, answer)
+                                if category in VALID_CATEGORIES}
+                    fresh = {keys[i]: category for i, category in answered.items() if keys[i]}
+                    results = [category or (fresh.get(key) if key else answered.get(i))
+                               for i, (category, key) in enumerate(zip(results, keys))]
+                    await run_db(store_ai_categories, fresh)
+                else:
+                    logger.warning(f"⚠️ Gemini returned {len(answer) if isinstance(answer, list) else 'no'} answers for {len(misses)} channels")
+            except Exception as e:
+                logger.error(f"Gemini error: {e}")
+    
+    return [category or categorize_basic(name) for category, name in zip(results, channel_names)]
+
+# Keyword table for categorize_basic; earlier categories win on overlap
+CATEGORY_KEYWORDS = {
+    'Sports': ['sport', 'cricket', 'football', 'fifa', 'hockey', 'espn', 'star sports', 
+               'sony ten', 'euro sport', 'premier league', 'tennis', 'basketball', 'nba',
+               'women sports', 'athletics', 'olympics'],
+    'News': ['news', 'ndtv', 'aaj tak', 'abp', 'zee news', 'india today', 'republic', 
+             'times now', 'cnn', 'bbc', 'fox news', 'cnbc', 'breaking'],
+    'Movies': ['movie', 'cinema', 'pictures', 'pix', 'flix', 'max', 'hbo', 'film',
+               'hollywood', 'bollywood'],
+    'Music': ['music', 'mtv', '9xm', 'zoom', 'vh1', 'bindass', 'songs', 'radio'],
+    'Kids': ['kids', 'cartoon', 'nick', 'pogo', 'disney', 'sonic', 'hungama', 'junior',
+             'children', 'toon'],
+    'Documentary': ['discovery', 'national geo', 'nat geo', 'animal planet', 'history', 
+                    'tlc', 'wild', 'science', 'investigation'],
+    'Entertainment': ['star', 'sony', 'zee', 'colors', '&tv', 'sab', 'bharat', 'plus',
+                      'general entertainment', 'drama', 'reality'],
+    'Religious': ['aastha', 'sanskar', 'god', 'ishwar', 'devotional', 'spiritual',
+                  'religious', 'temple', 'church']
+}
+
+# One compiled alternation per category, checked in priority order
+CATEGORY_PATTERNS = [
+    (category, re.compile('|'.join(re.escape(word) for word in words)))
+    for category, words in CATEGORY_KEYWORDS.items()
+]
+
+# Single automaton over every keyword, valued with its category's priority index
+CATEGORY_ORDER = list(CATEGORY_KEYWORDS)
+KEYWORD_AUTOMATON = None
+if ahocorasick:
+    KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for priority, words in enumerate(CATEGORY_KEYWORDS.values()):
+        for word in words:
+            if not KEYWORD_AUTOMATON.exists(word):
+                KEYWORD_AUTOMATON.add_word(word, priority)
+    KEYWORD_AUTOMATON.make_automaton()
 
 def categorize_basic(name):
     """Enhanced keyword-based categorization"""
     n = name.lower()
     
-    keywords = {
-        'Sports': ['sport', 'cricket', 'football', 'fifa', 'hockey', 'espn', 'star sports', 
-                   'sony ten', 'euro sport', 'premier league', 'tennis', 'basketball', 'nba',
-                   'women sports', 'athletics', 'olympics'],
-        'News': ['news', 'ndtv', 'aaj tak', 'abp', 'zee news', 'india today', 'republic', 
-                 'times now', 'cnn', 'bbc', 'fox news', 'cnbc', 'breaking'],
-        'Movies': ['movie', 'cinema', 'pictures', 'pix', 'flix', 'max', 'hbo', 'film',
-                   'hollywood', 'bollywood'],
-        'Music': ['music', 'mtv', '9xm', 'zoom', 'vh1', 'bindass', 'songs', 'radio'],
-        'Kids': ['kids', 'cartoon', 'nick', 'pogo', 'disney', 'sonic', 'hungama', 'junior',
-                 'children', 'toon'],
-        'Documentary': ['discovery', 'national geo', 'nat geo', 'animal planet', 'history', 
-                        'tlc', 'wild', 'science', 'investigation'],
-        'Entertainment': ['star', 'sony', 'zee', 'colors', '&tv', 'sab', 'bharat', 'plus',
-                          'general entertainment', 'drama', 'reality'],
-        'Religious': ['aastha', 'sanskar', 'god', 'ishwar', 'devotional', 'spiritual',
-                      'religious', 'temple', 'church']
-    }
-    
-    for category, words in keywords.items():
-        if any(word in n for word in words):
+    if KEYWORD_AUTOMATON:
+        # One pass over the name; the highest-priority hit wins, not the first
+        best = None
+        for _, priority in KEYWORD_AUTOMATON.iter(n):
+            if best is None or priority < best:
+                best = priority
+                if not best:
+                    break  # nothing outranks the first category
+        return 'Other' if best is None else CATEGORY_ORDER[best]
+    
+    for category, pattern in CATEGORY_PATTERNS:
+        if pattern.search(n):
             return category
     
     return 'Other'
 
 # ============= DATA PARSING =============
 
-def parse_json_channels(content, source_info="unknown"):
+def build_json_channels(content):
+    """CPU-only half of a JSON import: decode and build channel documents.
+    Returns (found, pending, error_count), or None for an unsupported layout."""
+    # Raw bytes go to the parser undecoded; orjson rejects the UTF-8 BOM that
+    # Windows editors prepend (stdlib json skipped it), so drop it first
+    if isinstance(content, (bytes, bytearray)) and content.startswith(b'\xef\xbb\xbf'):
+        content = content[3:]
+    data = json_loads(content) if isinstance(content, (str, bytes, bytearray)) else content
+    
+    if isinstance(data, list):
+        channels_list = data
+    elif isinstance(data, dict) and 'channels' in data:
+        channels_list = data['channels']
+    else:
+        return None
+    
+    logger.info(f"✅ Found {len(channels_list)} channels in JSON")
+    
+    error_count = 0
+    pending = []
+    now_iso = datetime.now().isoformat()
+    
+    for idx, ch in enumerate(channels_list):
+        try:
+            cid = ch.get('id', f"ch_{idx}_{hashlib.md5(ch.get('name', 'unknown').encode(), usedforsecurity=False).hexdigest()[:8]}")
+            name = ch.get('name', 'Unknown')
+            # Keyword match inline; only names it can't place wait for Gemini
+            category = ch.get('category') or categorize_basic(name)
+            
+            channel_data = {
+                'id': cid,
+                'name': name,
+                'link': ch.get('link', ch.get('url', '')),
+                'logo': ch.get('logo', ''),
+                'drmScheme': ch.get('drmScheme', ''),
+                'drmLicense': ch.get('drmLicense', ''),
+                'cookie': ch.get('cookie', ''),
+                'category': category,
+                'stream_type': ch.get('stream_type', 'dash'),
+                'updated_at': now_iso,
+                'needs_category': category == 'Other' and not ch.get('category')
+            }
+            
+            pending.append(channel_data)
+            
+        except Exception as e:
+            logger.error(f"  ✗ Error processing channel {idx}: {e}")
+            error_count += 1
+            continue
+    
+    return len(channels_list), pending, error_count
+
+async def parse_json_channels(content, source_info="unknown"):
     """Parse JSON format channels with better duplicate handling"""
     
     # Skip empty content
@@ -647,93 +1449,39 @@ def parse_json_channels(content, source_info="unknown"):
         return False
     
     # Check if processed recently (10 minutes only)
-    content_hash = hashlib.md5(content.encode()).hexdigest()
+    content_hash = content_digest(content)
     
-    if MONGO_ENABLED:
-        ten_mins_ago = datetime.now() - timedelta(minutes=10)
-        recent = sources_col.find_one({
-            'hash': content_hash,
-            'processed_at': {'$gte': ten_mins_ago}
-        })
-        if recent:
-            logger.info(f"⏭️ Same source processed {(datetime.now() - recent['processed_at']).seconds} seconds ago")
-            return True
+    processed_at = await run_db(claim_source, content_hash, source_info)
+    if processed_at:
+        logger.info(f"⏭️ Same source processed {(source_now() - processed_at).seconds} seconds ago")
+        return True
     
     try:
-        data = json.loads(content) if isinstance(content, str) else content
-        
-        channels_list = []
-        if isinstance(data, list):
-            channels_list = data
-        elif isinstance(data, dict) and 'channels' in data:
-            channels_list = data['channels']
-        else:
+        # Decoding and document building run off the event loop; writes go through run_db
+        built = await asyncio.to_thread(build_json_channels, content)
+        if built is None:
             logger.error("❌ Invalid JSON format - expected array or object with 'channels' key")
+            await run_db(release_source, content_hash)
             return False
+        found, pending, error_count = built
         
-        logger.info(f"✅ Found {len(channels_list)} channels in JSON")
-        
-        saved_count = 0
-        updated_count = 0
-        error_count = 0
-        
-        for idx, ch in enumerate(channels_list):
-            try:
-                cid = ch.get('id', f"ch_{idx}_{hashlib.md5(ch.get('name', 'unknown').encode()).hexdigest()[:8]}")
-                
-                channel_data = {
-                    'id': cid,
-                    'name': ch.get('name', 'Unknown'),
-                    'link': ch.get('link', ch.get('url', '')),
-                    'logo': ch.get('logo', ''),
-                    'drmScheme': ch.get('drmScheme', ''),
-                    'drmLicense': ch.get('drmLicense', ''),
-                    'cookie': ch.get('cookie', ''),
-                    'category': ch.get('category'),
-                    'stream_type': ch.get('stream_type', 'dash'),
-                    'updated_at': datetime.now().isoformat(),
-                    'needs_category': not ch.get('category')
-                }
-                
-                # Check if exists
-                existing = get_channel(cid)
-                if existing:
-                    logger.info(f"  ↻ Updating: {ch.get('name', 'Unknown')}")
-                    updated_count += 1
-                else:
-                    logger.info(f"  ✓ Adding: {ch.get('name', 'Unknown')}")
-                    saved_count += 1
-                
-                save_channel(channel_data)
-                
-                # Progress logging
-                if (idx + 1) % 10 == 0:
-                    logger.info(f"  📊 Progress: {idx + 1}/{len(channels_list)} channels processed")
-                
-            except Exception as e:
-                logger.error(f"  ✗ Error processing channel {idx}: {e}")
-                error_count += 1
-                continue
+        # New vs updated comes from the bulk write result, not a lookup per row
+        saved_count, updated_count = await run_db(save_channels, pending)
         
         # Mark as processed
-        if MONGO_ENABLED:
-            sources_col.update_one(
-                {'hash': content_hash},
-                {'$set': {
-                    'hash': content_hash,
-                    'source': source_info,
-                    'processed_at': datetime.now(),
-                    'channel_count': len(channels_list),
-                    'new': saved_count,
-                    'updated': updated_count,
-                    'errors': error_count
-                }},
-                upsert=True
-            )
+        await run_db(
+            mark_source_processed,
+            content_hash,
+            source_info,
+            channel_count=found,
+            new=saved_count,
+            updated=updated_count,
+            errors=error_count
+        )
         
         logger.info(f"""
 ✅ JSON Import Complete:
-   • Total Found: {len(channels_list)}
+   • Total Found: {found}
    • New: {saved_count}
    • Updated: {updated_count}
    • Errors: {error_count}
@@ -743,15 +1491,79 @@ def parse_json_channels(content, source_info="unknown"):
     
     except json.JSONDecodeError as e:
         logger.error(f"❌ JSON parse error: {e}")
+        await run_db(release_source, content_hash)
         return False
     except Exception as e:
         logger.error(f"❌ Error processing JSON: {e}")
         import traceback
         traceback.print_exc()
+        await run_db(release_source, content_hash)
         return False
 
+def build_m3u_channels(content, source_url=''):
+    """CPU-only half of an M3U import: decode, parse and build channel documents in one pass.
+    Returns (found, pending, error_count); run off the event loop."""
+    # Determine base URL for relative paths
+    base_url = ''
+    if source_url:
+        parsed = urlparse(source_url)
+        base_url = f"{parsed.scheme}://{parsed.netloc}"
+        logger.info(f"🔗 Base URL: {base_url}")
+    
+    # Handle servertvhub.site style
+    if 'servertvhub.site' in source_url or 'playlist.php' in source_url:
+        logger.info("🔍 Detected servertvhub.site playlist")
+        if not isinstance(content, str):
+            content = content.decode('utf-8', errors='replace')
+        channels_list = parse_servertvhub_playlist(content, base_url)
+    else:
+        logger.info("🔍 Parsing standard M3U playlist")
+        # Consumed lazily: each channel is completed as soon as its URL line is parsed
+        channels_list = iter_m3u_channels(content, base_url)
+    
+    found = error_count = 0
+    pending = []
+    # One timestamp per import; md5 stays so existing m3u_ ids are stable
+    now_iso = datetime.now().isoformat()
+    _md5 = hashlib.md5
+    _append = pending.append
+    
+    for idx, ch in enumerate(channels_list):
+        found += 1
+        try:
+            get = ch.get
+            name, link, category = ch['name'], ch['link'], get('category')
+            # Keyword match inline; only names it can't place wait for Gemini
+            needs_category = not category
+            if needs_category:
+                category = categorize_basic(name)
+                needs_category = category == 'Other'
+            # Generate unique ID based on name and link
+            cid = get('id') or f"m3u_{_md5(f'{name}_{link}'.encode(), usedforsecurity=False).hexdigest()[:8]}"
+            
+            # The parsers return fresh dicts with a subset of these keys, so complete
+            # each one in place rather than copying it into a second document
+            ch['id'] = cid
+            ch['logo'] = get('logo', '')
+            ch['category'] = category
+            ch['stream_type'] = get('stream_type', 'hls')
+            ch['needs_proxy'] = get('needs_proxy', False)
+            ch['is_php_endpoint'] = get('is_php_endpoint', False)
+            ch['updated_at'] = now_iso
+            ch['needs_category'] = needs_category
+            _append(ch)
+            
+        except Exception as e:
+            logger.error(f"  ✗ Error saving channel {idx} ({ch.get('name', 'Unknown')}): {e}")
+            error_count += 1
+            continue
+    
+    if found:
+        logger.info(f"✅ Found {found} channels in playlist")
+    return found, pending, error_count
+
 async def parse_m3u_playlist(content, source_url='', source_info='unknown'):
-    """Parse M3U playlist with improved duplicate checking"""
+    """Parse M3U playlist (text or raw UTF-8 bytes) with improved duplicate checking"""
     
     # Skip duplicate check if content is empty
     if not content or len(content.strip()) < 10:
@@ -759,107 +1571,57 @@ async def parse_m3u_playlist(content, source_url='', source_info='unknown'):
         return False
     
     # Create a unique hash based on content
-    content_hash = hashlib.md5(content.encode()).hexdigest()
+    content_hash = content_digest(content)
     
     # Check if processed in last 10 minutes only (more lenient)
-    if MONGO_ENABLED:
-        ten_mins_ago = datetime.now() - timedelta(minutes=10)
-        recent = sources_col.find_one({
-            'hash': content_hash,
-            'processed_at': {'$gte': ten_mins_ago}
-        })
-        if recent:
-            logger.info(f"⏭️ Same source processed {(datetime.now() - recent['processed_at']).seconds} seconds ago")
-            # Still return the count as success
-            return True
+    processed_at = await run_db(claim_source, content_hash, source_info)
+    if processed_at:
+        logger.info(f"⏭️ Same source processed {(source_now() - processed_at).seconds} seconds ago")
+        # Still return the count as success
+        return True
     
     try:
-        # Determine base URL for relative paths
-        base_url = ''
-        if source_url:
-            parsed = urlparse(source_url)
-            base_url = f"{parsed.scheme}://{parsed.netloc}"
-            logger.info(f"🔗 Base URL: {base_url}")
-        
-        # Handle servertvhub.site style
-        if 'servertvhub.site' in source_url or 'playlist.php' in source_url:
-            logger.info("🔍 Detected servertvhub.site playlist")
-            channels_list = parse_servertvhub_playlist(content, base_url)
-        else:
-            logger.info("🔍 Parsing standard M3U playlist")
-            channels_list = parse_m3u_content(content, base_url)
+        found, pending, error_count = await asyncio.to_thread(
+            build_m3u_channels, content, source_url
+        )
         
-        if not channels_list:
+        if not found:
             logger.error("❌ No channels found in playlist")
+            await run_db(release_source, content_hash)
             return False
         
-        logger.info(f"✅ Found {len(channels_list)} channels in playlist")
-        
-        # Save channels with progress logging
-        saved_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        for idx, ch in enumerate(channels_list):
-            try:
-                # Generate unique ID based on name and link
-                unique_str = f"{ch['name']}_{ch['link']}"
-                unique_hash = hashlib.md5(unique_str.encode()).hexdigest()[:8]
-                cid = ch.get('id', f"m3u_{unique_hash}")
-                
-                channel_data = {
-                    'id': cid,
-                    'name': ch['name'],
-                    'link': ch['link'],
-                    'logo': ch.get('logo', ''),
-                    'category': ch.get('category'),
-                    'stream_type': ch.get('stream_type', 'hls'),
-                    'needs_proxy': ch.get('needs_proxy', False),
-                    'is_php_endpoint': ch.get('is_php_endpoint', False),
-                    'updated_at': datetime.now().isoformat(),
-                    'needs_category': not ch.get('category')
-                }
-                
-                # Check if channel already exists
-                existing = get_channel(cid)
-                if existing:
-                    logger.info(f"  ↻ Updating: {ch['name']}")
-                    skipped_count += 1
-                else:
-                    logger.info(f"  ✓ Adding: {ch['name']}")
-                
-                save_channel(channel_data)
-                saved_count += 1
-                
-                # Log progress every 10 channels
-                if (idx + 1) % 10 == 0:
-                    logger.info(f"  📊 Progress: {idx + 1}/{len(channels_list)} channels processed")
-                
-            except Exception as e:
-                logger.error(f"  ✗ Error saving channel {idx} ({ch.get('name', 'Unknown')}): {e}")
-                error_count += 1
-                continue
+        # Batched upserts; existing vs new comes from the results. A source whose
+        # earlier import died part-way resumes after its last checkpoint.
+        resume_from = await run_db(source_checkpoint, content_hash)
+        if resume_from:
+            logger.info(f"⏩ Resuming import after {resume_from} channels")
+        new_count = skipped_count = 0
+        for start_idx in range(resume_from, len(pending), IMPORT_CHECKPOINT):
+            chunk = pending[start_idx:start_idx + IMPORT_CHECKPOINT]
+            new, updated = await run_db(save_channels, chunk)
+            new_count += new
+            skipped_count += updated
+            # The final chunk is covered by mark_source_processed below
+            if start_idx + len(chunk) < len(pending):
+                await run_db(checkpoint_source, content_hash, start_idx + len(chunk))
+        # Channels before resume_from were saved by the interrupted run
+        saved_count = resume_from + new_count + skipped_count
         
         # Mark source as processed
-        if MONGO_ENABLED:
-            sources_col.update_one(
-                {'hash': content_hash},
-                {'$set': {
-                    'hash': content_hash,
-                    'source': source_info,
-                    'source_url': source_url,
-                    'processed_at': datetime.now(),
-                    'channel_count': saved_count,
-                    'total_found': len(channels_list),
-                    'skipped': skipped_count,
-                    'errors': error_count
-                }},
-                upsert=True
-            )
+        await run_db(
+            mark_source_processed,
+            content_hash,
+            source_info,
+            source_url=source_url,
+            channel_count=saved_count,
+            total_found=found,
+            skipped=skipped_count,
+            errors=error_count
+        )
         
         logger.info(f"""
 ✅ M3U Import Complete:
-   • Total Found: {len(channels_list)}
+   • Total Found: {found}
    • New/Updated: {saved_count}
    • Already Existed: {skipped_count}
    • Errors: {error_count}
@@ -871,57 +1633,193 @@ async def parse_m3u_playlist(content, source_url='', source_info='unknown'):
         logger.error(f"❌ M3U parse error: {e}")
         import traceback
         traceback.print_exc()
+        await run_db(release_source, content_hash)
         return False
 
-async def auto_categorize_all():
-    """Auto-categorize channels without category"""
-    channels = get_all_channels()
-    uncategorized = [(cid, ch) for cid, ch in channels.items() 
-                     if ch.get('needs_category', False)]
+# Categorization results are written back in bulk batches of this size
+CATEGORIZE_BATCH = 1000
+# Seconds between progress edits; stays under Telegram's per-chat edit limit
+PROGRESS_EDIT_INTERVAL = 2
+
+async def auto_categorize_all(msg=None):
+    """Auto-categorize channels without category, editing msg with throttled progress"""
+    uncategorized = await run_db(get_uncategorized_channels)
+    
+    # Names Gemini already answered (for any channel or import) are applied up front,
+    # in one lookup, so only unseen names go through the prompt groups
+    if uncategorized:
+        known = await run_db(lookup_ai_categories, [category_key(ch['name']) for _, ch in uncategorized])
+        cached = {cid: category for (cid, _), category in zip(uncategorized, known) if category}
+        if cached:
+            await run_db(save_categories, cached)
+            logger.info(f"♻️ {len(cached)} channels categorized from earlier Gemini answers")
+            uncategorized = [pair for pair, category in zip(uncategorized, known) if not category]
     
     if not uncategorized:
         logger.info("✅ All channels already categorized")
         return
     
-    logger.info(f"🤖 Categorizing {len(uncategorized)} channels...")
+    total = len(uncategorized)
+    logger.info(f"🤖 Categorizing {total} channels...")
     
-    for idx, (cid, ch) in enumerate(uncategorized, 1):
-        try:
-            category = await categorize_with_ai(ch['name'])
-            ch['category'] = category
-            ch['needs_category'] = False
-            save_channel(ch)
-            
-            logger.info(f"[{idx}/{len(uncategorized)}] {ch['name']} → {category}")
-            
-            if gemini_model:
-                await asyncio.sleep(1)
-        except Exception as e:
-            logger.error(f"Categorization error: {e}")
-            ch['category'] = 'Other'
-            save_channel(ch)
+    semaphore = asyncio.Semaphore(AI_CONCURRENCY)
+    done = 0
+    
+    async def categorize_group(group):
+        nonlocal done
+        async with semaphore:
+            try:
+                categories = await categorize_with_ai_batch([ch['name'] for _, ch in group])
+            except Exception as e:
+                logger.error(f"Categorization error: {e}")
+                categories = ['Other'] * len(group)
+            done += len(group)
+            logger.info(f"[{done}/{total}] channels categorized")
+            return [(cid, category) for (cid, _), category in zip(group, categories)]
+    
+    async def report_progress():
+        shown = 0
+        while True:
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+            if done == shown:
+                continue
+            shown = done
+            try:
+                await msg.edit_text(
+                    f"🤖 <b>Categorizing channels...</b>\n\n⏳ {shown}/{total} done",
+                    parse_mode='HTML'
+                )
+            except BadRequest:
+                pass
+    
+    progress_task = asyncio.create_task(report_progress()) if msg else None
+    try:
+        # All groups share the semaphore, so a slow prompt never stalls the next batch;
+        # results are flushed to the DB as they complete
+        assignments = {}
+        for group in asyncio.as_completed([
+            categorize_group(uncategorized[i:i + AI_BATCH_SIZE]) for i in range(0, total, AI_BATCH_SIZE)
+        ]):
+            assignments.update(await group)
+            if len(assignments) >= CATEGORIZE_BATCH:
+                await run_db(save_categories, assignments)
+                assignments = {}
+        await run_db(save_categories, assignments)
+    finally:
+        if progress_task:
+            progress_task.cancel()
     
     logger.info("✅ Categorization complete!")
 
+# Serializes background categorization so overlapping loads don't double-categorize
+_categorize_lock = asyncio.Lock()
+
+async def categorize_in_background(msg):
+    """Background task: categorize new channels, then edit msg with the final stats"""
+    async with _categorize_lock:
+        try:
+            await auto_categorize_all(msg)
+            stats = await run_db(get_stats)
+            await msg.edit_text(
+                f"🎉 <b>Successfully Loaded!</b>\n\n📺 Total Channels: {stats['channels']}\n🗂 Categories: {stats['categories']}\n\n<i>Use /start to browse channels</i>",
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.error(f"❌ Background categorization error: {e}")
+
+# Shared session for playlist downloads; lives for the bot's lifetime
+HTTP_SESSION = None
+
+# Playlist downloads in flight at once; the session's pool holds the same number of sockets
+PLAYLIST_FETCHES = 10
+
+def get_http_session():
+    """Return the shared playlist session, creating it on first use"""
+    global HTTP_SESSION
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        HTTP_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=PLAYLIST_FETCHES, ttl_dns_cache=300, keepalive_timeout=60),
+            # sock_read drops a stalled host long before the overall deadline
+            timeout=aiohttp.ClientTimeout(total=60, sock_read=15),
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Accept': '*/*',
+                'Accept-Language': 'en-US,en;q=0.9',
+                'Referer': 'https://www.google.com/'
+            }
+        )
+    return HTTP_SESSION
+
+async def open_http_session(application):
+    """post_init hook: create the shared aiohttp session on the bot loop"""
+    get_http_session()
+
+async def close_http_session(application):
+    """post_shutdown hook: close the shared aiohttp session"""
+    if HTTP_SESSION:
+        await HTTP_SESSION.close()
+
+_stats_task = None
+_watch_task = None
+
+async def post_init(application):
+    """Open shared resources once the bot's event loop is running"""
+    global BOT_APP, _stats_task, _watch_task
+    BOT_APP = application
+    # Bounded pool behind run_db/to_thread instead of the CPU-scaled default
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='jiotv-io')
+    )
+    # Warm the index-covered category reads so the first menu render skips MongoDB;
+    # full channel documents are only fetched one at a time by get_channel
+    await run_db(get_category_buttons)
+    await run_db(get_category_tokens)
+    await open_http_session(application)
+    await start_web()
+    if MONGO_ENABLED:
+        _stats_task = asyncio.create_task(flush_stats_loop())
+        _watch_task = asyncio.create_task(asyncio.to_thread(watch_channel_changes))
+
+async def post_shutdown(application):
+    """Release shared resources before the event loop closes"""
+    await stop_web()
+    await close_http_session(application)
+    if _stats_task:
+        _stats_task.cancel()
+        await asyncio.to_thread(flush_stats)
+    if _watch_task:
+        _watch_stop.set()
+        await _watch_task
+    if MONGO_ENABLED:
+        mongo_client.close()
+        logger.info("👋 MongoDB connection closed")
+
+# Cap on playlist downloads in flight, so multi-URL loads don't hammer one host
+PLAYLIST_FETCH_LIMIT = asyncio.Semaphore(PLAYLIST_FETCHES)
+
+# Playlist bodies are streamed in chunks of this size and abandoned past the cap
+PLAYLIST_CHUNK = 64 * 1024
+MAX_PLAYLIST_BYTES = int(os.environ.get('MAX_PLAYLIST_BYTES', 64 * 1024 * 1024))
+
 async def load_from_url(url):
-    """Load playlist from URL with better error handling"""
+    """Download a playlist as raw bytes, streamed and capped at MAX_PLAYLIST_BYTES"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': 'https://www.google.com/'
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=60)) as response:
-                if response.status == 200:
-                    content = await response.text()
-                    logger.info(f"✅ Successfully loaded URL: {url} ({len(content)} bytes)")
-                    return content
-                else:
-                    logger.error(f"❌ Failed to load URL: HTTP {response.status}")
+        async with PLAYLIST_FETCH_LIMIT, get_http_session().get(url) as response:
+            if response.status == 200:
+                if (response.content_length or 0) > MAX_PLAYLIST_BYTES:
+                    logger.error(f"❌ Playlist too large: {response.content_length} bytes")
                     return None
+                content = bytearray()
+                async for chunk in response.content.iter_chunked(PLAYLIST_CHUNK):
+                    content += chunk
+                    if len(content) > MAX_PLAYLIST_BYTES:
+                        logger.error(f"❌ Playlist exceeded {MAX_PLAYLIST_BYTES} bytes: {url}")
+                        return None
+                logger.info(f"✅ Successfully loaded URL: {url} ({len(content)} bytes)")
+                return content
+            else:
+                logger.error(f"❌ Failed to load URL: HTTP {response.status}")
+                return None
     except asyncio.TimeoutError:
         logger.error(f"⏱️ Timeout loading URL: {url}")
         return None
@@ -931,15 +1829,23 @@ async def load_from_url(url):
 
 # ============= PAGINATION HELPERS =============
 
+# Keyboard rows shared by every menu; buttons are immutable, so one instance serves all renders
+MAIN_MENU_ROW = [InlineKeyboardButton("🏠 Main Menu", callback_data="start")]
+SEARCH_ROW = [InlineKeyboardButton("🔍 Search Channels", switch_inline_query_current_chat="")]
+ADMIN_PANEL_ROW = [InlineKeyboardButton("⚙️ Admin Panel", callback_data="admin")]
+
 def paginate_list(items, page, per_page):
     """Paginate a list of items"""
     start = page * per_page
     end = start + per_page
     return items[start:end], len(items)
 
-def create_pagination_keyboard(items, page, per_page, callback_prefix, back_callback="start", columns=2):
-    """Create paginated keyboard with 2 columns"""
-    current_items, total_items = paginate_list(items, page, per_page)
+def create_pagination_keyboard(items, page, per_page, callback_prefix, back_callback="start", columns=2, total_items=None):
+    """Create paginated keyboard with 2 columns (pass total_items if items is already the page)"""
+    if total_items is None:
+        current_items, total_items = paginate_list(items, page, per_page)
+    else:
+        current_items = items
     total_pages = (total_items + per_page - 1) // per_page
     
     keyboard = []
@@ -964,12 +1870,86 @@ def create_pagination_keyboard(items, page, per_page, callback_prefix, back_call
     if nav_buttons:
         keyboard.append(nav_buttons)
     
-    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=back_callback)])
+    keyboard.append(MAIN_MENU_ROW if back_callback == "start" else
+                    [InlineKeyboardButton("🏠 Main Menu", callback_data=back_callback)])
     
     return keyboard
 
+@functools.lru_cache(maxsize=1024)
+def category_token(category):
+    """Short stable id for a category in callback data (names can exceed Telegram's 64 bytes)"""
+    return hashlib.blake2b(category.encode(), digest_size=6).hexdigest()
+
+@cached_read
+def get_category_tokens():
+    """category_token -> category name for every current category"""
+    return {category_token(cat): cat for cat in get_category_counts()}
+
+@cached_read
+def get_category_buttons():
+    """Sorted category buttons shared by the main menu and its pages"""
+    categories = get_category_counts()
+    return [
+        InlineKeyboardButton(f"📺 {cat} ({categories[cat]})", callback_data=f"c_{category_token(cat)}_page_0")
+        for cat in sorted(categories.keys())
+    ]
+
+# Finished main-menu markups by (page, admin); cleared with the read cache
+_category_menus = {}
+
+async def category_menu_keyboard(page, user_id):
+    """Main-menu markup for one page of categories, shared by every user with the same view"""
+    key = (page, is_admin(user_id))
+    markup = _category_menus.get(key)
+    if markup:
+        return markup
+    gen = _read_cache_gen
+    buttons = await run_db(get_category_buttons)
+    start_idx = page * CATEGORIES_PER_PAGE
+    keyboard = create_pagination_keyboard(
+        buttons[start_idx:start_idx + CATEGORIES_PER_PAGE],
+        page,
+        CATEGORIES_PER_PAGE,
+        "categories",
+        "start",
+        columns=2,
+        total_items=len(buttons)
+    )
+    
+    keyboard.insert(-1, SEARCH_ROW)
+    
+    if key[1]:
+        keyboard.insert(-1, ADMIN_PANEL_ROW)
+    markup = InlineKeyboardMarkup(keyboard)
+    # Skip storing if channel data changed while the buttons were being read
+    if gen == _read_cache_gen:
+        _category_menus[key] = markup
+    return markup
+
 # ============= TELEGRAM BOT HANDLERS =============
 
+# Digest of the text/markup we last rendered per message, to skip no-op edits
+RENDER_CACHE_SIZE = 1024
+_last_render = OrderedDict()
+
+async def safe_edit(msg, text, **kwargs):
+    """edit_text that skips the Telegram round-trip when msg already shows this content"""
+    markup = kwargs.get('reply_markup')
+    digest = hashlib.blake2b(
+        (text + (markup.to_json() if markup else '')).encode(), digest_size=16
+    ).digest()
+    key = (msg.chat_id, msg.message_id)
+    # edit_date changes on any other edit, so a stale digest never matches
+    if _last_render.get(key) == (msg.edit_date, digest):
+        return msg
+    edited = await msg.edit_text(text, **kwargs)
+    if isinstance(edited, Message):
+        _last_render[key] = (edited.edit_date, digest)
+        _last_render.move_to_end(key)
+        if len(_last_render) > RENDER_CACHE_SIZE:
+            _last_render.popitem(last=False)
+    return edited
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main menu with paginated categories (2 columns)"""
     user = update.effective_user
@@ -982,31 +1962,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("🔧 Bot under maintenance!")
         return
     
-    categories = get_categories()
-    categories_list = sorted(categories.keys())
-    
-    cat_buttons = []
-    for cat in categories_list:
-        cat_buttons.append(InlineKeyboardButton(
-            f"📺 {cat} ({len(categories[cat])})", 
-            callback_data=f"cat_{cat}_0"
-        ))
-    
-    keyboard = create_pagination_keyboard(
-        cat_buttons,
-        0,
-        CATEGORIES_PER_PAGE,
-        "categories",
-        "start",
-        columns=2
-    )
-    
-    keyboard.insert(-1, [InlineKeyboardButton("🔍 Search Channels", switch_inline_query_current_chat="")])
+    markup = await category_menu_keyboard(0, user.id)
     
-    if is_admin(user.id):
-        keyboard.insert(-1, [InlineKeyboardButton("⚙️ Admin Panel", callback_data="admin")])
-    
-    stats = get_stats()
+    stats = await run_db(get_stats)
     text = f"""
 🎬 <b>{bot_settings['bot_name']}</b>
 
@@ -1022,13 +1980,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         await update.callback_query.message.edit_text(
             text, 
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=markup,
             parse_mode='HTML'
         )
     else:
         await update.message.reply_text(
             text, 
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=markup,
             parse_mode='HTML'
         )
 
@@ -1039,31 +1997,9 @@ async def categories_page_handler(update: Update, context: ContextTypes.DEFAULT_
     
     page = int(query.data.split('_')[-1])
     
-    categories = get_categories()
-    categories_list = sorted(categories.keys())
-    
-    cat_buttons = []
-    for cat in categories_list:
-        cat_buttons.append(InlineKeyboardButton(
-            f"📺 {cat} ({len(categories[cat])})", 
-            callback_data=f"cat_{cat}_0"
-        ))
-    
-    keyboard = create_pagination_keyboard(
-        cat_buttons,
-        page,
-        CATEGORIES_PER_PAGE,
-        "categories",
-        "start",
-        columns=2
-    )
-    
-    keyboard.insert(-1, [InlineKeyboardButton("🔍 Search Channels", switch_inline_query_current_chat="")])
-    
-    if is_admin(query.from_user.id):
-        keyboard.insert(-1, [InlineKeyboardButton("⚙️ Admin Panel", callback_data="admin")])
+    markup = await category_menu_keyboard(page, query.from_user.id)
     
-    stats = get_stats()
+    stats = await run_db(get_stats)
     text = f"""
 🎬 <b>{bot_settings['bot_name']}</b>
 
@@ -1075,79 +2011,40 @@ async def categories_page_handler(update: Update, context: ContextTypes.DEFAULT_
     
     await query.message.edit_text(
         text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=markup,
         parse_mode='HTML'
     )
 
 async def category_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show paginated channels in a category (2 columns, full names)"""
+    """Open a category from an older message's callback data: cat_<category>_<n>"""
     query = update.callback_query
-    await query.answer()
-    
     parts = query.data.split('_')
-    page = int(parts[-1])
-    cat = '_'.join(parts[1:-1])
-    
-    channels = get_channels_by_category(cat)
-    
-    if not channels:
-        await query.answer("No channels in this category!", show_alert=True)
-        return
-    
-    channel_buttons = []
-    for ch in channels:
-        # Use full channel name (truncate only if very long)
-        name = ch['name'][:40] + '...' if len(ch['name']) > 40 else ch['name']
-        channel_buttons.append(InlineKeyboardButton(
-            f"▶️ {name}", 
-            callback_data=f"play_{ch['id']}"
-        ))
-    
-    keyboard = create_pagination_keyboard(
-        channel_buttons,
-        page,
-        CHANNELS_PER_PAGE,
-        f"cat_{cat}",
-        "start",
-        columns=2
-    )
-    
-    text = f"""
-📺 <b>{cat}</b>
+    await category_handler_with_page(update, context, '_'.join(parts[1:-1]), int(parts[-1]))
 
-Total: {len(channels)} channels
-
-<i>Select a channel to watch:</i>
-"""
-    
-    await query.message.edit_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='HTML'
-    )
+@functools.lru_cache(maxsize=CHANNEL_CACHE_SIZE)
+def play_markup(cid, category):
+    """Player keyboard for a channel; markups are immutable, so repeat opens share one"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎬 Watch Now", web_app=WebAppInfo(url=f"{WEBAPP_URL}/player?id={cid}"))],
+        [InlineKeyboardButton("🔙 Back", callback_data=f"c_{category_token(category)}_page_0")],
+        MAIN_MENU_ROW
+    ])
 
 async def play_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Open channel in mini player"""
     query = update.callback_query
-    await query.answer("🎬 Opening player...")
     
     cid = query.data.replace('play_', '')
-    ch = get_channel(cid)
+    ch = await run_db(get_channel, cid)
     
+    # A callback can only be answered once, so answer after the lookup
     if not ch:
         await query.answer("❌ Channel not found!", show_alert=True)
         return
+    await query.answer("🎬 Opening player...")
     
     update_stats('plays', 1)
     
-    player_url = f"{WEBAPP_URL}/player?id={cid}"
-    
-    keyboard = [
-        [InlineKeyboardButton("🎬 Watch Now", web_app=WebAppInfo(url=player_url))],
-        [InlineKeyboardButton("🔙 Back", callback_data=f"cat_{ch.get('category', 'Other')}_0")],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data="start")]
-    ]
-    
     info_text = f"""
 🎬 <b>{ch['name']}</b>
 
@@ -1160,38 +2057,30 @@ async def play_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.message.edit_text(
         info_text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=play_markup(cid, ch.get('category', 'Other')),
         parse_mode='HTML'
     )
 
-async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    
-    if not is_admin(query.from_user.id):
-        await query.answer("⛔ Unauthorized!", show_alert=True)
-        return
-    
-    await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📤 Upload JSON", callback_data="admin_upload_json"),
-            InlineKeyboardButton("📤 Upload M3U", callback_data="admin_upload_m3u")
-        ],
-        [
-            InlineKeyboardButton("🔗 Load JSON URL", callback_data="admin_url_json"),
-            InlineKeyboardButton("🔗 Load M3U URL", callback_data="admin_url_m3u")
-        ],
-        [InlineKeyboardButton("🤖 AI Categorize", callback_data="admin_categorize")],
-        [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
-        [
-            InlineKeyboardButton("🗑️ Clear Cache", callback_data="admin_clear_cache"),
-            InlineKeyboardButton("🗑️ Clear All", callback_data="admin_clear")
-        ],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data="start")]
-    ]
-    
-    stats = get_stats()
+ADMIN_KB = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📤 Upload JSON", callback_data="admin_upload_json"),
+        InlineKeyboardButton("📤 Upload M3U", callback_data="admin_upload_m3u")
+    ],
+    [
+        InlineKeyboardButton("🔗 Load JSON URL", callback_data="admin_url_json"),
+        InlineKeyboardButton("🔗 Load M3U URL", callback_data="admin_url_m3u")
+    ],
+    [InlineKeyboardButton("🤖 AI Categorize", callback_data="admin_categorize")],
+    [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
+    [
+        InlineKeyboardButton("🗑️ Clear Cache", callback_data="admin_clear_cache"),
+        InlineKeyboardButton("🗑️ Clear All", callback_data="admin_clear")
+    ],
+    MAIN_MENU_ROW
+])
+
+def render_admin(stats):
+    """Admin panel text and keyboard for the given stats"""
     text = f"""
 ⚙️ <b>Admin Panel</b>
 
@@ -1205,8 +2094,19 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 <i>Select an option below:</i>
 """
+    return text, ADMIN_KB
+
+async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
     
-    await query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    if not is_admin(query.from_user.id):
+        await query.answer("⛔ Unauthorized!", show_alert=True)
+        return
+    
+    await query.answer()
+    
+    text, keyboard = render_admin(await run_db(get_stats))
+    await query.message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
 
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
@@ -1235,32 +2135,26 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         file_obj = await context.bot.get_file(file.file_id)
         content = await file_obj.download_as_bytearray()
-        content_str = content.decode('utf-8')
         
         await msg.edit_text(
-            f"✅ <b>File Downloaded!</b>\n\n📦 Size: {len(content_str)} bytes\n🔄 Parsing {file_type.upper()} data...",
+            f"✅ <b>File Downloaded!</b>\n\n📦 Size: {len(content)} bytes\n🔄 Parsing {file_type.upper()} data...",
             parse_mode='HTML'
         )
         
         success = False
         
         if file_type == 'json':
-            success = parse_json_channels(content_str, f"file:{file.file_name}")
+            # JSON is parsed and hashed straight from the downloaded bytes
+            success = await parse_json_channels(content, f"file:{file.file_name}")
         elif file_type == 'm3u':
-            success = await parse_m3u_playlist(content_str, '', f"file:{file.file_name}")
+            success = await parse_m3u_playlist(content, '', f"file:{file.file_name}")
         
         if success:
             await msg.edit_text(
-                f"✅ <b>Parsing Complete!</b>\n\n🤖 Starting AI categorization...",
-                parse_mode='HTML'
-            )
-            await auto_categorize_all()
-            stats = get_stats()
-            
-            await msg.edit_text(
-                f"🎉 <b>Successfully Loaded!</b>\n\n📺 Total Channels: {stats['channels']}\n🗂 Categories: {stats['categories']}\n\n<i>Use /start to browse channels</i>",
+                f"✅ <b>Parsing Complete!</b>\n\n🤖 Categorizing in background...",
                 parse_mode='HTML'
             )
+            context.application.create_task(categorize_in_background(msg))
         else:
             await msg.edit_text(
                 f"❌ <b>Parsing Failed!</b>\n\n⚠️ Possible reasons:\n• Invalid {file_type.upper()} format\n• Source already processed\n• Empty or corrupted data\n\n<i>Check logs for details</i>",
@@ -1268,154 +2162,188 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
     
     except Exception as e:
-        logger.error(f"File error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("File error")
         await msg.edit_text(
-            f"❌ <b>Error Processing File!</b>\n\n⚠️ Error: <code>{str(e)}</code>",
+            f"❌ <b>Error Processing File!</b>\n\n⚠️ Error: <code>{html.escape(str(e))}</code>",
             parse_mode='HTML'
         )
     
     finally:
         context.user_data.pop('expecting_file_type', None)
 
-async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Static admin screens, built once instead of on every click
+ADMIN_BACK_KB = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]])
+ADMIN_CANCEL_ROW = [InlineKeyboardButton("🔙 Cancel", callback_data="admin")]
+ADMIN_CANCEL_KB = InlineKeyboardMarkup([ADMIN_CANCEL_ROW])
+ADMIN_UPLOAD_JSON_TEXT = "📤 <b>Upload JSON File</b>\n\n<b>Required format:</b>\n<code>[\n  {\n    \"name\": \"Channel Name\",\n    \"link\": \"stream_url\",\n    \"logo\": \"logo_url\",\n    \"drmScheme\": \"clearkey\",\n    \"drmLicense\": \"key:id\",\n    \"cookie\": \"cookie_string\"\n  }\n]</code>\n\n<i>Send your .json file now</i>"
+ADMIN_UPLOAD_M3U_TEXT = "📤 <b>Upload M3U/M3U8 File</b>\n\n<b>Supported format:</b>\n<code>#EXTINF:-1 tvg-id=\"id\" tvg-name=\"name\" tvg-logo=\"logo\" group-title=\"category\",Channel Name\nhttp://stream-url.m3u8</code>\n\n<i>Send your .m3u or .m3u8 file now</i>"
+ADMIN_URL_JSON_TEXT = "🔗 <b>Load JSON from URL</b>\n\n<i>Send the JSON URL now:</i>\n\nExample:\n<code>https://example.com/channels.json</code>"
+ADMIN_URL_M3U_TEXT = "🔗 <b>Load M3U from URL</b>\n\n<i>Send the M3U/M3U8 URL now:</i>\n\nExamples:\n<code>https://example.com/playlist.m3u8\nhttps://servertvhub.site/playlist.php</code>"
+ADMIN_CLEAR_TEXT = "⚠️ <b>Warning!</b>\n\n<i>This will permanently delete all channels and categories. Are you sure?</i>"
+ADMIN_CLEAR_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Confirm Delete All", callback_data="admin_clear_confirm")],
+    ADMIN_CANCEL_ROW
+])
+ADMIN_CLEARED_TEXT = "✅ <b>Database Cleared!</b>\n<i>All channels and categories have been deleted.</i>\n"
+URL_ERROR_TEXT = "❌ <b>Error Loading URL!</b>\n\n⚠️ Error: <code>{err}</code>\n\n<i>Please try again or contact admin</i>"
+URL_PARSE_FAILED_TEXT = "❌ <b>Parsing Failed!</b>\n\n⚠️ Possible reasons:\n• Invalid {kind} format\n• Source already processed\n• Empty or corrupted data\n\n<i>Please check the URL and try again</i>"
+
+async def noop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Dismiss the spinner on inert buttons (page counter, unknown data)"""
+    await update.callback_query.answer()
+
+async def start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    await start(update, context)
+
+async def category_token_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Open a category page from its token: c_<token>_page_<n>"""
+    cat = (await run_db(get_category_tokens)).get(context.match.group(1))
+    if cat is None:
+        await update.callback_query.answer("❌ This category no longer exists!", show_alert=True)
+        return
+    await category_handler_with_page(update, context, cat, int(context.match.group(2)))
+
+async def category_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle category pagination from older messages: cat_<category>_page_<n>"""
+    cat, page = context.match.group(1), int(context.match.group(2))
+    await category_handler_with_page(update, context, cat, page)
+
+async def admin_categorize_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    data = query.data
-    
-    if data == "noop":
-        await query.answer()
+    # Share the background runs' lock so a button press can't double-bill Gemini
+    if _categorize_lock.locked():
+        await query.answer("⏳ Categorization is already running", show_alert=True)
         return
-    
-    if data == "start":
-        await query.answer()
-        await start(update, context)
-    elif data.startswith("categories_page_"):
-        await categories_page_handler(update, context)
-    elif data.startswith("cat_") and "_page_" in data:
-        # Handle category pagination - extract page number and category
-        parts = data.split('_')
-        # Find 'page' index
-        page_index = parts.index('page')
-        page = int(parts[page_index + 1])
-        # Everything between 'cat' and 'page' is the category name
-        cat = '_'.join(parts[1:page_index])
-        
-        # Call category handler with reconstructed data
-        await category_handler_with_page(update, context, cat, page)
-    elif data.startswith("cat_"):
-        await category_handler(update, context)
-    elif data.startswith("play_"):
-        await play_handler(update, context)
-    elif data == "admin":
-        await admin_handler(update, context)
-    elif data == "admin_categorize":
-        await query.answer("🤖 Starting AI categorization...")
+    await query.answer("🤖 Starting AI categorization...")
+    async with _categorize_lock:
         msg = await query.message.edit_text("🤖 <b>AI Categorization in Progress...</b>\n\n⏳ Please wait...", parse_mode='HTML')
-        await auto_categorize_all()
-        await msg.edit_text("✅ <b>Categorization Complete!</b>\n\n<i>Returning to admin panel...</i>", parse_mode='HTML')
-        await asyncio.sleep(1)
-        await admin_handler(update, context)
-    elif data == "admin_upload_json":
-        await query.answer()
-        context.user_data['expecting_file_type'] = 'json'
-        await query.message.edit_text(
-            "📤 <b>Upload JSON File</b>\n\n<b>Required format:</b>\n<code>[\n  {\n    \"name\": \"Channel Name\",\n    \"link\": \"stream_url\",\n    \"logo\": \"logo_url\",\n    \"drmScheme\": \"clearkey\",\n    \"drmLicense\": \"key:id\",\n    \"cookie\": \"cookie_string\"\n  }\n]</code>\n\n<i>Send your .json file now</i>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_upload_m3u":
-        await query.answer()
-        context.user_data['expecting_file_type'] = 'm3u'
-        await query.message.edit_text(
-            "📤 <b>Upload M3U/M3U8 File</b>\n\n<b>Supported format:</b>\n<code>#EXTINF:-1 tvg-id=\"id\" tvg-name=\"name\" tvg-logo=\"logo\" group-title=\"category\",Channel Name\nhttp://stream-url.m3u8</code>\n\n<i>Send your .m3u or .m3u8 file now</i>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_url_json":
-        await query.answer()
-        context.user_data['awaiting_url'] = 'json'
-        await query.message.edit_text(
-            "🔗 <b>Load JSON from URL</b>\n\n<i>Send the JSON URL now:</i>\n\nExample:\n<code>https://example.com/channels.json</code>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Cancel", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_url_m3u":
-        await query.answer()
-        context.user_data['awaiting_url'] = 'm3u'
-        await query.message.edit_text(
-            "🔗 <b>Load M3U from URL</b>\n\n<i>Send the M3U/M3U8 URL now:</i>\n\nExamples:\n<code>https://example.com/playlist.m3u8\nhttps://servertvhub.site/playlist.php</code>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Cancel", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_stats":
-        await query.answer()
-        categories = get_categories()
-        cat_list = "\n".join([f"• <b>{c}</b>: {len(ch)} channels" for c, ch in sorted(categories.items())[:15]])
-        stats = get_stats()
-        
-        await query.message.edit_text(
-            f"📊 <b>Detailed Statistics</b>\n\n<b>Categories:</b>\n{cat_list}\n\n💾 Storage: {'MongoDB' if MONGO_ENABLED else 'Memory Cache'}",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]]),
-            parse_mode='HTML'
+        await auto_categorize_all(msg)
+    await msg.edit_text("✅ <b>Categorization Complete!</b>\n\n<i>Returning to admin panel...</i>", parse_mode='HTML')
+    await asyncio.sleep(1)
+    await admin_handler(update, context)
+
+async def admin_upload_json_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data['expecting_file_type'] = 'json'
+    await query.message.edit_text(
+        ADMIN_UPLOAD_JSON_TEXT,
+        reply_markup=ADMIN_BACK_KB,
+        parse_mode='HTML'
+    )
+
+async def admin_upload_m3u_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data['expecting_file_type'] = 'm3u'
+    await query.message.edit_text(
+        ADMIN_UPLOAD_M3U_TEXT,
+        reply_markup=ADMIN_BACK_KB,
+        parse_mode='HTML'
+    )
+
+async def admin_url_json_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data['awaiting_url'] = 'json'
+    await query.message.edit_text(
+        ADMIN_URL_JSON_TEXT,
+        reply_markup=ADMIN_CANCEL_KB,
+        parse_mode='HTML'
+    )
+
+async def admin_url_m3u_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data['awaiting_url'] = 'm3u'
+    await query.message.edit_text(
+        ADMIN_URL_M3U_TEXT,
+        reply_markup=ADMIN_CANCEL_KB,
+        parse_mode='HTML'
+    )
+
+async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    categories = await run_db(get_category_counts)
+    # Largest categories first; only the shown rows are ordered
+    top = heapq.nlargest(15, categories.items(), key=lambda item: item[1])
+    cat_list = "\n".join([f"• <b>{c}</b>: {count} channels" for c, count in top])
+    
+    await query.message.edit_text(
+        f"📊 <b>Detailed Statistics</b>\n\n<b>Categories:</b>\n{cat_list}\n\n💾 Storage: {'MongoDB' if MONGO_ENABLED else 'Memory Cache'}",
+        reply_markup=ADMIN_BACK_KB,
+        parse_mode='HTML'
+    )
+
+async def admin_clear_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer("⚠️ This will delete all data!", show_alert=True)
+    await safe_edit(query.message, ADMIN_CLEAR_TEXT, reply_markup=ADMIN_CLEAR_KB, parse_mode='HTML')
+
+async def admin_clear_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if MONGO_ENABLED and DEDICATED_DB:
+        await asyncio.to_thread(mongo_client.drop_database, DB_NAME)
+        await asyncio.to_thread(ensure_indexes)
+    elif MONGO_ENABLED:
+        # Dropping is O(1) server-side, unlike deleting every document
+        await asyncio.gather(
+            asyncio.to_thread(channels_col.drop),
+            asyncio.to_thread(sources_col.drop)
         )
-    elif data == "admin_clear":
-        await query.answer("⚠️ This will delete all data!", show_alert=True)
-        keyboard = [
-            [InlineKeyboardButton("❌ Confirm Delete All", callback_data="admin_clear_confirm")],
-            [InlineKeyboardButton("🔙 Cancel", callback_data="admin")]
-        ]
+        await asyncio.to_thread(ensure_indexes)
+    else:
+        channels_cache.clear()
+        categories_cache.clear()
+    invalidate_read_cache()
+    forget_sources()
+    
+    # One edit: clear notice on top of the refreshed admin panel
+    text, keyboard = render_admin(await run_db(get_stats))
+    await safe_edit(query.message, ADMIN_CLEARED_TEXT + text, reply_markup=keyboard, parse_mode='HTML')
+
+async def admin_clear_cache_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer("🗑️ Clearing duplicate check cache...")
+    # Old source records are purged by the TTL index; only the local memos need dropping
+    forget_sources()
+    if MONGO_ENABLED:
         await query.message.edit_text(
-            "⚠️ <b>Warning!</b>\n\n<i>This will permanently delete all channels and categories. Are you sure?</i>",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            f"✅ <b>Cache Cleared!</b>\n\n🗑️ Source records expire automatically after {SOURCE_TTL // 60} minutes\n\n<i>Sources imported over 10 minutes ago can be re-imported</i>",
             parse_mode='HTML'
         )
-    elif data == "admin_clear_confirm":
-        await query.answer()
-        if MONGO_ENABLED:
-            channels_col.delete_many({})
-            sources_col.delete_many({})
-        else:
-            channels_cache.clear()
-            categories_cache.clear()
-        
+    else:
         await query.message.edit_text(
-            "✅ <b>Database Cleared!</b>\n\n<i>All channels and categories have been deleted.</i>",
+            "ℹ️ <b>Cache Not Applicable</b>\n\n<i>Memory mode doesn't use source tracking</i>",
             parse_mode='HTML'
         )
-        await asyncio.sleep(2)
-        await admin_handler(update, context)
-    elif data == "admin_clear_cache":
-        await query.answer("🗑️ Clearing duplicate check cache...")
-        if MONGO_ENABLED:
-            # Only clear old source records (older than 1 hour)
-            one_hour_ago = datetime.now() - timedelta(hours=1)
-            result = sources_col.delete_many({'processed_at': {'$lt': one_hour_ago}})
-            await query.message.edit_text(
-                f"✅ <b>Cache Cleared!</b>\n\n🗑️ Removed {result.deleted_count} old source records\n\n<i>You can now re-import sources</i>",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.edit_text(
-                "ℹ️ <b>Cache Not Applicable</b>\n\n<i>Memory mode doesn't use source tracking</i>",
-                parse_mode='HTML'
-            )
-        await asyncio.sleep(2)
-        await admin_handler(update, context)
+    await asyncio.sleep(2)
+    await admin_handler(update, context)
 
 async def category_handler_with_page(update: Update, context: ContextTypes.DEFAULT_TYPE, cat: str, page: int):
     """Show paginated channels in a category with specific page"""
     query = update.callback_query
-    await query.answer()
     
-    channels = get_channels_by_category(cat)
+    # The count is cached and the page is one skip/limit query; fetch both at once
+    counts, channels = await asyncio.gather(
+        run_db(get_category_counts),
+        run_db(get_channels_by_category, cat, skip=page * CHANNELS_PER_PAGE)
+    )
+    total = counts.get(cat, 0)
     
+    # A callback can only be answered once, so the alert replaces the plain answer
     if not channels:
         await query.answer("No channels in this category!", show_alert=True)
         return
+    await query.answer()
     
+    # Only the visible page is fetched, so build buttons for just those rows
     channel_buttons = []
     for ch in channels:
+        # Use full channel name (truncate only if very long)
         name = ch['name'][:40] + '...' if len(ch['name']) > 40 else ch['name']
         channel_buttons.append(InlineKeyboardButton(
             f"▶️ {name}", 
@@ -1426,15 +2354,16 @@ async def category_handler_with_page(update: Update, context: ContextTypes.DEFAU
         channel_buttons,
         page,
         CHANNELS_PER_PAGE,
-        f"cat_{cat}",
+        f"c_{category_token(cat)}",
         "start",
-        columns=2
+        columns=2,
+        total_items=total
     )
     
     text = f"""
 📺 <b>{cat}</b>
 
-Total: {len(channels)} channels
+Total: {total} channels
 Page: {page + 1}
 
 <i>Select a channel to watch:</i>
@@ -1445,86 +2374,51 @@ Page: {page + 1}
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
-        
-        # Reconstruct the callback data
-    if data.startswith("catpage_"):
-        cat, page = data.replace("catpage_", "").rsplit("_", 1)
-        page = int(page)
-        context.user_data['current_category'] = cat
-        query.data = f"cat_{cat}_{page}"
-        await category_handler(update, context)
-    elif data.startswith("cat_"):
-        await category_handler(update, context)
-    elif data.startswith("play_"):
-        await play_handler(update, context)
-    elif data == "admin":
-        await admin_handler(update, context)
-    elif data == "admin_categorize":
-        await query.answer("🤖 Starting AI categorization...", show_alert=True)
-        await auto_categorize_all()
-        await query.answer("✅ Categorization complete!", show_alert=True)
-        await admin_handler(update, context)
-    elif data == "admin_upload_json":
-        await query.answer()
-        context.user_data['expecting_file_type'] = 'json'
-        await query.message.edit_text(
-            "📤 <b>Upload JSON File</b>\n\n<b>Required format:</b>\n<code>[\n  {\n    \"name\": \"Channel Name\",\n    \"link\": \"stream_url\",\n    \"logo\": \"logo_url\",\n    \"drmScheme\": \"clearkey\",\n    \"drmLicense\": \"key:id\",\n    \"cookie\": \"cookie_string\"\n  }\n]</code>\n\n<i>Send your .json file now</i>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_upload_m3u":
-        await query.answer()
-        context.user_data['expecting_file_type'] = 'm3u'
-        await query.message.edit_text(
-            "📤 <b>Upload M3U/M3U8 File</b>\n\n<b>Supported format:</b>\n<code>#EXTINF:-1 tvg-id=\"id\" tvg-name=\"name\" tvg-logo=\"logo\" group-title=\"category\",Channel Name\nhttp://stream-url.m3u8</code>\n\n<i>Send your .m3u or .m3u8 file now</i>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_url_json":
-        context.user_data['awaiting_url'] = 'json'
-        await query.message.edit_text(
-            "🔗 <b>Load JSON from URL</b>\n\n<i>Send the JSON URL now:</i>\n\nExample:\n<code>https://example.com/channels.json</code>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Cancel", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_url_m3u":
-        context.user_data['awaiting_url'] = 'm3u'
-        await query.message.edit_text(
-            "🔗 <b>Load M3U from URL</b>\n\n<i>Send the M3U/M3U8 URL now:</i>\n\nExamples:\n<code>https://example.com/playlist.m3u8\nhttps://servertvhub.site/playlist.php</code>",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Cancel", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_stats":
-        categories = get_categories()
-        cat_list = "\n".join([f"• <b>{c}</b>: {len(ch)} channels" for c, ch in sorted(categories.items())[:15]])
-        stats = get_stats()
-        
-        await query.message.edit_text(
-            f"📊 <b>Detailed Statistics</b>\n\n<b>Categories:</b>\n{cat_list}\n\n💾 Storage: {'MongoDB' if MONGO_ENABLED else 'Memory Cache'}",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin")]]),
-            parse_mode='HTML'
-        )
-    elif data == "admin_clear":
-        await query.answer("⚠️ This will delete all data!", show_alert=True)
-        keyboard = [
-            [InlineKeyboardButton("❌ Confirm Delete All", callback_data="admin_clear_confirm")],
-            [InlineKeyboardButton("🔙 Cancel", callback_data="admin")]
-        ]
-        await query.message.edit_text(
-            "⚠️ <b>Warning!</b>\n\n<i>This will permanently delete all channels and categories. Are you sure?</i>",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+
+
+# In-flight URL imports keyed by (type, url)
+_url_inflight = {}
+
+async def import_from_url(url, url_type, msg=None):
+    """Download and parse a playlist URL; None if the download failed, else parse success"""
+    # Both parsers take the raw bytes, so the body is never decoded and re-encoded for hashing
+    content = await load_from_url(url)
+    
+    if not content:
+        return None
+    
+    if msg:
+        await msg.edit_text(
+            f"✅ <b>Content Downloaded!</b>\n\n📦 Size: {len(content)} bytes\n🔄 Parsing {url_type.upper()} data...",
             parse_mode='HTML'
         )
-    elif data == "admin_clear_confirm":
-        if MONGO_ENABLED:
-            channels_col.delete_many({})
-            sources_col.delete_many({})
-            await query.answer("✅ Database cleared successfully!", show_alert=True)
-        else:
-            channels_cache.clear()
-            categories_cache.clear()
-            await query.answer("✅ Cache cleared successfully!", show_alert=True)
-        await admin_handler(update, context)
+    
+    if url_type == 'json':
+        return await parse_json_channels(content, f"url:{url}")
+    elif url_type == 'm3u':
+        return await parse_m3u_playlist(content, url, f"url:{url}")
+    return False
+
+async def import_url_once(url, url_type, msg=None):
+    """import_from_url, shared with any concurrent submission of the same URL"""
+    key = (url_type, url)
+    seen = _recent_urls.get(key)
+    if seen and time.monotonic() - seen < RECENT_URL_TTL:
+        logger.info(f"⏭️ URL imported {int(time.monotonic() - seen)} seconds ago, skipping download")
+        return True
+    
+    task = _url_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(import_from_url(url, url_type, msg))
+        _url_inflight[key] = task
+        task.add_done_callback(lambda t: _url_inflight.pop(key, None))
+    result = await task
+    if result is True:
+        _recent_urls[key] = time.monotonic()
+        _recent_urls.move_to_end(key)
+        if len(_recent_urls) > RECENT_URLS_SIZE:
+            _recent_urls.popitem(last=False)
+    return result
 
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages (URL loading)"""
@@ -1532,7 +2426,9 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         url_type = context.user_data.get('awaiting_url')
         context.user_data['awaiting_url'] = None
         
-        url = update.message.text.strip()
+        # One URL per line/word; several are downloaded concurrently
+        urls = update.message.text.split()
+        url = urls[0] if len(urls) == 1 else f"{len(urls)} URLs"
         
         msg = await update.message.reply_text(
             f"⏳ <b>Loading from URL...</b>\n\n🔗 URL: <code>{url}</code>\n📥 Downloading content...",
@@ -1540,72 +2436,160 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            content = await load_from_url(url)
+            if len(urls) > 1:
+                results = await asyncio.gather(
+                    *(import_url_once(u, url_type) for u in urls), return_exceptions=True
+                )
+                loaded = sum(1 for r in results if r is True)
+                failed = "\n".join(f"• <code>{u}</code>" for u, r in zip(urls, results) if r is not True)
+                text = f"📥 <b>Loaded {loaded}/{len(urls)} URLs</b>"
+                if failed:
+                    text += f"\n\n❌ Failed:\n{failed}"
+                if loaded:
+                    text += "\n\n🤖 Categorizing in background..."
+                await msg.edit_text(text, parse_mode='HTML')
+                if loaded:
+                    context.application.create_task(categorize_in_background(msg))
+                return
+            
+            # Concurrent submissions of the same URL wait on the first one's import
+            success = await import_url_once(url, url_type, msg)
             
-            if not content:
+            if success is None:
                 await msg.edit_text(
                     f"❌ <b>Failed to Load URL!</b>\n\n🔗 URL: <code>{url}</code>\n\n<i>Please check:\n• URL is accessible\n• Network connection\n• URL format is correct</i>",
                     parse_mode='HTML'
                 )
                 return
             
-            await msg.edit_text(
-                f"✅ <b>Content Downloaded!</b>\n\n📦 Size: {len(content)} bytes\n🔄 Parsing {url_type.upper()} data...",
-                parse_mode='HTML'
-            )
-            
-            success = False
-            
-            if url_type == 'json':
-                success = parse_json_channels(content, f"url:{url}")
-            elif url_type == 'm3u':
-                success = await parse_m3u_playlist(content, url, f"url:{url}")
-            
             if success:
                 await msg.edit_text(
-                    f"✅ <b>Parsing Complete!</b>\n\n🤖 Starting AI categorization...",
-                    parse_mode='HTML'
-                )
-                await auto_categorize_all()
-                
-                stats = get_stats()
-                await msg.edit_text(
-                    f"🎉 <b>Successfully Loaded!</b>\n\n📺 Total Channels: {stats['channels']}\n🗂 Categories: {stats['categories']}\n\n<i>Use /start to browse channels</i>",
+                    f"✅ <b>Parsing Complete!</b>\n\n🤖 Categorizing in background...",
                     parse_mode='HTML'
                 )
+                context.application.create_task(categorize_in_background(msg))
             else:
-                await msg.edit_text(
-                    f"❌ <b>Parsing Failed!</b>\n\n⚠️ Possible reasons:\n• Invalid {url_type.upper()} format\n• Source already processed\n• Empty or corrupted data\n\n<i>Please check the URL and try again</i>",
-                    parse_mode='HTML'
-                )
+                await msg.edit_text(URL_PARSE_FAILED_TEXT.format(kind=url_type.upper()), parse_mode='HTML')
                 
         except Exception as e:
-            logger.error(f"URL loading error: {e}")
-            await msg.edit_text(
-                f"❌ <b>Error Loading URL!</b>\n\n⚠️ Error: <code>{str(e)}</code>\n\n<i>Please try again or contact admin</i>",
-                parse_mode='HTML'
-            )
+            logger.exception("URL loading error")
+            # Exception text can contain <, > or &, which would break the HTML parse
+            await msg.edit_text(URL_ERROR_TEXT.format(err=html.escape(str(e))), parse_mode='HTML')
+
+# Only messages and button presses have handlers; skip every other update type
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+# Telegram holds an idle getUpdates for at most 50 s
+POLL_TIMEOUT = 50
+
+async def run_webhook(app_bot):
+    """Webhook mode: updates arrive via the Quart /telegram route on the shared web server"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await app_bot.initialize()
+    # Tear down like run_polling does, even if startup or the web server fails
+    try:
+        await post_init(app_bot)
+        await app_bot.bot.set_webhook(
+            url=f"{WEBAPP_URL}/telegram",
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True,
+            secret_token=WEBHOOK_SECRET
+        )
+        await app_bot.start()
+        logger.info("🪝 Webhook mode: waiting for updates")
+        
+        # Updates only arrive through the web server, so its exit ends webhook mode too
+        stopped = asyncio.create_task(stop.wait())
+        await asyncio.wait({stopped, _web_task}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+    finally:
+        if app_bot.running:
+            await app_bot.stop()
+        await post_shutdown(app_bot)
+        await app_bot.shutdown()
 
 def main():
-    # Start Flask
-    Thread(target=run_flask, daemon=True).start()
-    
-    # Start Bot
-    app_bot = Application.builder().token(BOT_TOKEN).build()
+    # Must be in place before run_polling/asyncio.run create the loop
+    if uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    
+    # Start Bot (the web server runs on the same loop via post_init)
+    app_bot = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(256)
+        .pool_timeout(30)
+        .connect_timeout(10)
+        .read_timeout(30)
+        .write_timeout(30)
+        .get_updates_connection_pool_size(1)
+        .get_updates_pool_timeout(30)
+        .get_updates_read_timeout(POLL_TIMEOUT + 5)
+        # Queue outbound calls under Telegram's flood limits and retry once on RetryAfter
+        .rate_limiter(AIORateLimiter(max_retries=1))
+        # Handle updates as independent tasks so one slow import doesn't stall other users
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    app_bot.add_handler(CommandHandler("start", start))
-    app_bot.add_handler(CallbackQueryHandler(callback_router))
-    app_bot.add_handler(MessageHandler(filters.Document.ALL, handle_file))
-    app_bot.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    # Order matters: the first matching handler in the group wins
+    app_bot.add_handlers([
+        CommandHandler("start", start),
+        CallbackQueryHandler(noop_callback, pattern=r'^noop$'),
+        CallbackQueryHandler(start_callback, pattern=r'^start$'),
+        CallbackQueryHandler(categories_page_handler, pattern=r'^categories_page_\d+$'),
+        CallbackQueryHandler(category_token_callback, pattern=r'^c_([0-9a-f]{12})_page_(\d+)$'),
+        # Name-based callbacks from messages sent before category tokens
+        CallbackQueryHandler(category_page_callback, pattern=r'^cat_(.+)_page_(\d+)$'),
+        CallbackQueryHandler(category_handler, pattern=r'^cat_'),
+        CallbackQueryHandler(play_handler, pattern=r'^play_'),
+        CallbackQueryHandler(admin_handler, pattern=r'^admin$'),
+        CallbackQueryHandler(admin_categorize_callback, pattern=r'^admin_categorize$'),
+        CallbackQueryHandler(admin_upload_json_callback, pattern=r'^admin_upload_json$'),
+        CallbackQueryHandler(admin_upload_m3u_callback, pattern=r'^admin_upload_m3u$'),
+        CallbackQueryHandler(admin_url_json_callback, pattern=r'^admin_url_json$'),
+        CallbackQueryHandler(admin_url_m3u_callback, pattern=r'^admin_url_m3u$'),
+        CallbackQueryHandler(admin_stats_callback, pattern=r'^admin_stats$'),
+        CallbackQueryHandler(admin_clear_callback, pattern=r'^admin_clear$'),
+        CallbackQueryHandler(admin_clear_confirm_callback, pattern=r'^admin_clear_confirm$'),
+        CallbackQueryHandler(admin_clear_cache_callback, pattern=r'^admin_clear_cache$'),
+        CallbackQueryHandler(noop_callback),
+        MessageHandler(filters.Document.ALL, handle_file),
+        MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler)
+    ])
+    
+    # One record, so the banner can't interleave with worker-thread output
+    logger.info(
+        "🚀 Bot started successfully!\n"
+        "   📡 Web Server: %s\n"
+        "   🤖 Gemini AI: %s\n"
+        "   💾 MongoDB: %s\n"
+        "   📄 Categories per page: %d (2 columns)\n"
+        "   📺 Channels per page: %d (2 columns)",
+        WEBAPP_URL,
+        'ENABLED' if gemini_model else 'DISABLED',
+        'CONNECTED' if MONGO_ENABLED else 'DISABLED',
+        CATEGORIES_PER_PAGE,
+        CHANNELS_PER_PAGE
+    )
     
-    logger.info("🚀 Bot started successfully!")
-    logger.info(f"📡 Web Server: {WEBAPP_URL}")
-    logger.info(f"🤖 Gemini AI: {'ENABLED' if gemini_model else 'DISABLED'}")
-    logger.info(f"💾 MongoDB: {'CONNECTED' if MONGO_ENABLED else 'DISABLED'}")
-    logger.info(f"📄 Categories per page: {CATEGORIES_PER_PAGE} (2 columns)")
-    logger.info(f"📺 Channels per page: {CHANNELS_PER_PAGE} (2 columns)")
+    if USE_WEBHOOK:
+        asyncio.run(run_webhook(app_bot))
+        return
     
-    app_bot.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Long-poll: Telegram holds getUpdates open for up to POLL_TIMEOUT when idle
+    app_bot.run_polling(
+        allowed_updates=ALLOWED_UPDATES,
+        timeout=POLL_TIMEOUT,
+        poll_interval=0.0,
+        drop_pending_updates=True,
+        stop_signals=(signal.SIGINT, signal.SIGTERM)
+    )
 
 if __name__ == '__main__':
     main()